@@ -1,5 +1,15 @@
+import json
+
+from django import VERSION as DJANGO_VERSION, forms
+from django.conf import settings
 from django.contrib import admin
-from django.db.models import F
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
 from django_celery_beat.admin import PeriodicTaskAdmin
 from django_celery_beat.models import PeriodicTask
@@ -56,20 +66,179 @@ class TenantPeriodicTaskAdmin(PeriodicTaskAdmin):
     inlines = [PeriodicTaskTenantLinkInline]
 
     def tenant(self, instance):
-        return instance.periodic_task_tenant_link.tenant.name
+        return instance.periodic_task_tenant_link.get_tenant_info().name
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         if not is_public(request):
             qs = qs.filter(periodic_task_tenant_link__tenant=request.tenant)
-        return qs.annotate(
-            tenant=F("periodic_task_tenant_link__tenant__name")
-        ).select_related("periodic_task_tenant_link__tenant")
+        return qs.select_related("periodic_task_tenant_link")
+
+
+class TenantAutocompleteFilter(admin.ListFilter):
+    """Filter by tenant, chosen with an autocomplete rather than a list of tenants.
+
+    Tenants are searched with the admin's autocomplete view, so the `ModelAdmin` of the
+    tenant model must define `search_fields`.
+    """
+
+    title = "tenant"
+    parameter_name = "tenant"
+    template = "django_tenants_celery_beat/admin/autocomplete_filter.html"
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.value = params.pop(self.parameter_name, None)
+        self.field = forms.ModelChoiceField(
+            get_tenant_model().objects.all(),
+            widget=tenant_autocomplete_widget(model_admin.admin_site),
+        )
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return [self.parameter_name]
+
+    def queryset(self, request, queryset):
+        if not self.value:
+            return queryset
+        try:
+            return queryset.filter(
+                periodic_task_tenant_link__tenant=self.field.clean(self.value)
+            )
+        except ValidationError as e:
+            raise IncorrectLookupParameters(e)
+
+    def choices(self, changelist):
+        # The template also needs the autocomplete and the other query parameters
+        self.widget = self.field.widget.render(
+            self.parameter_name,
+            self.value,
+            attrs={"onchange": "this.form.submit()", "style": "width: 100%"},
+        )
+        self.params = [
+            (name, value)
+            for name, value in changelist.params.items()
+            if name not in (self.parameter_name, "p")
+        ]
+        yield {
+            "selected": self.value is None,
+            "query_string": changelist.get_query_string(remove=[self.parameter_name]),
+            "display": "All",
+        }
+
+
+class CachedTaskListFilter(admin.SimpleListFilter):
+    """Filter by task name, with the distinct task names cached.
+
+    The names are those of the PeriodicTasks the admin shows to the request's tenant,
+    and are cached per tenant for `TENANT_BEAT_ADMIN_CACHE_TIMEOUT` seconds (default
+    300), so newly added tasks may take that long to show up.
+    """
+
+    title = "task"
+    parameter_name = "task"
+    cache_key = "django_tenants_celery_beat:admin:task_names"
+
+    def lookups(self, request, model_admin):
+        task_names = cache.get_or_set(
+            f"{self.cache_key}:{request.tenant.schema_name}",
+            lambda: list(
+                model_admin.get_queryset(request)
+                .order_by("task")
+                .values_list("task", flat=True)
+                .distinct()
+            ),
+            getattr(settings, "TENANT_BEAT_ADMIN_CACHE_TIMEOUT", 300),
+        )
+        return [(task_name, task_name) for task_name in task_names]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        return queryset.filter(task=self.value())
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that counts large result sets with the query planner's estimate.
+
+    Counting every matching row gets slow with many rows, so if PostgreSQL estimates
+    at least `exact_count_threshold` rows, the estimate is used instead. The page
+    numbers of large result sets are then only approximate.
+    """
+
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        try:
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            return 0
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = plan[0]["Plan"]["Plan Rows"]
+        if estimate < self.exact_count_threshold:
+            return queryset.count()
+        return estimate
+
+
+class ScalableTenantPeriodicTaskAdmin(TenantPeriodicTaskAdmin):
+    """PeriodicTask admin for databases with very many tenant PeriodicTasks.
+
+    Compared to `TenantPeriodicTaskAdmin`, the changelist does not list every tenant,
+    task or start date to filter by, estimates the number of results of large queries,
+    and is always ordered by the (unique, and so indexed) name. Use it by setting
+    `TENANT_BEAT_SCALABLE_ADMIN = True`.
+    """
+
+    list_filter = [
+        TenantAutocompleteFilter,
+        "enabled",
+        "one_off",
+        CachedTaskListFilter,
+        "start_time",
+        "last_run_at",
+    ]
+    date_hierarchy = None
+    ordering = ("name",)
+    sortable_by = ()
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        return super().media + tenant_autocomplete_widget(self.admin_site).media
+
+    def get_list_filter(self, request):
+        if is_public(request):
+            return self.list_filter
+        # Other tenants' PeriodicTasks are not shown anyway
+        return [
+            list_filter
+            for list_filter in self.list_filter
+            if list_filter is not TenantAutocompleteFilter
+        ]
 
 
 admin.site.unregister(PeriodicTask)
-admin.site.register(PeriodicTask, TenantPeriodicTaskAdmin)
+if getattr(settings, "TENANT_BEAT_SCALABLE_ADMIN", False):
+    admin.site.register(PeriodicTask, ScalableTenantPeriodicTaskAdmin)
+else:
+    admin.site.register(PeriodicTask, TenantPeriodicTaskAdmin)
 
 
 def is_public(request):
     return request.tenant.schema_name == get_public_schema_name()
+
+
+def tenant_autocomplete_widget(admin_site):
+    field = get_periodic_task_tenant_link_model()._meta.get_field("tenant")
+    if DJANGO_VERSION < (3, 2):
+        field = field.remote_field
+    return AutocompleteSelect(field, admin_site)
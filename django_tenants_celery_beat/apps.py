@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class DjangoTenantsCeleryBeatConfig(AppConfig):
     name = 'django_tenants_celery_beat'
+
+    def ready(self):
+        if getattr(settings, "TENANT_BEAT_METRICS_SINK", None):
+            from django_tenants_celery_beat.metrics import connect_signals
+
+            connect_signals()
@@ -0,0 +1,156 @@
+"""Leader election between beat processes sharing a database.
+
+Only one of the processes using the same lock name sends tasks at a time, while the
+others wait on standby to take over as soon as the lock is free.
+"""
+import logging
+import os
+import socket
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import (
+    DatabaseError,
+    IntegrityError,
+    InterfaceError,
+    connections,
+    transaction,
+)
+from django.db.models import DateTimeField, ExpressionWrapper, Q
+from django.db.models.functions import Now
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCK_NAME = "django_tenants_celery_beat"
+DEFAULT_LOCK_TTL = 30
+
+
+class AdvisoryLeaderLock:
+    """Leadership held as a Postgres session-level advisory lock.
+
+    The lock is taken on a connection of its own rather than Django's, which may be
+    closed between ticks, so it is held for as long as the process is alive, and is
+    released by Postgres as soon as the process or its connection dies.
+    """
+
+    def __init__(self, name, using="default"):
+        self.name = name
+        self.key = zlib.crc32(name.encode())
+        self.using = using
+        self.connection = None
+        self.held = False
+
+    def acquire(self):
+        """Take the lock if it is free, and return whether it is held."""
+        if self.held:
+            sql = (
+                "SELECT EXISTS(SELECT 1 FROM pg_locks WHERE locktype = 'advisory' "
+                "AND pid = pg_backend_pid() AND granted AND classid = 0 "
+                "AND objid::bigint = %s AND objsubid = 1)"
+            )
+        else:
+            sql = "SELECT pg_try_advisory_lock(%s)"
+        try:
+            with self._cursor() as cursor:
+                cursor.execute(sql, [self.key])
+                self.held = cursor.fetchone()[0]
+        except (DatabaseError, InterfaceError) as exc:
+            logger.warning("Could not take the leader lock %r: %r", self.name, exc)
+            self.close()
+        return self.held
+
+    def release(self):
+        """Release the lock, if held, and close its connection."""
+        if self.held:
+            try:
+                with self._cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", [self.key])
+            except (DatabaseError, InterfaceError):
+                pass
+        self.close()
+
+    def close(self):
+        self.held = False
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except (DatabaseError, InterfaceError):
+                pass
+            self.connection = None
+
+    def _cursor(self):
+        if self.connection is None:
+            wrapper = connections[self.using]
+            self.connection = type(wrapper)(dict(wrapper.settings_dict), self.using)
+        return self.connection.cursor()
+
+
+class TableLeaderLock:
+    """Leadership held as a `BeatLeaderLock` row that expires after `ttl` seconds.
+
+    The holder renews the row each time it takes the lock, and any other process can
+    take it over once it has expired. Expiry is measured by the database's clock.
+    """
+
+    def __init__(self, name, ttl=DEFAULT_LOCK_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+
+    def acquire(self):
+        """Take or renew the lock if it is free, and return whether it is held."""
+        from django_tenants_celery_beat.models import BeatLeaderLock
+
+        expires_at = ExpressionWrapper(
+            Now() + timedelta(seconds=self.ttl), output_field=DateTimeField()
+        )
+        try:
+            with transaction.atomic():
+                self.held = bool(
+                    BeatLeaderLock.objects.filter(
+                        Q(owner=self.owner) | Q(expires_at__lt=Now()), name=self.name
+                    ).update(owner=self.owner, expires_at=expires_at)
+                )
+                if not self.held:
+                    BeatLeaderLock.objects.create(
+                        name=self.name, owner=self.owner, expires_at=expires_at
+                    )
+                    self.held = True
+        except IntegrityError:
+            # Held by another process
+            self.held = False
+        except (DatabaseError, InterfaceError) as exc:
+            logger.warning("Could not take the leader lock %r: %r", self.name, exc)
+            self.held = False
+        return self.held
+
+    def release(self):
+        """Release the lock, if held."""
+        from django_tenants_celery_beat.models import BeatLeaderLock
+
+        if self.held:
+            try:
+                BeatLeaderLock.objects.filter(name=self.name, owner=self.owner).delete()
+            except (DatabaseError, InterfaceError):
+                pass
+        self.held = False
+
+
+def get_leader_lock(name=DEFAULT_LOCK_NAME):
+    """Return the leader lock configured by the `TENANT_BEAT_LEADER_LOCK` setting.
+
+    This is "advisory" or "table", and defaults to "advisory" on Postgres.
+    """
+    backend = getattr(settings, "TENANT_BEAT_LEADER_LOCK", None)
+    if backend is None:
+        backend = (
+            "advisory" if connections["default"].vendor == "postgresql" else "table"
+        )
+    if backend == "advisory":
+        return AdvisoryLeaderLock(name)
+    return TableLeaderLock(
+        name, ttl=getattr(settings, "TENANT_BEAT_LEADER_LOCK_TTL", DEFAULT_LOCK_TTL)
+    )
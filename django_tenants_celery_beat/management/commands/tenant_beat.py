@@ -0,0 +1,181 @@
+import re
+
+import pytz
+from celery.schedules import crontab
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django_celery_beat.models import PeriodicTask, PeriodicTasks
+
+from django_tenants_celery_beat.models import crontab_cache
+from django_tenants_celery_beat.utils import get_periodic_task_tenant_link_model
+
+
+class Command(BaseCommand):
+    help = (
+        "Enable, disable or reschedule tenants' periodic tasks in bulk. Tasks are "
+        "chosen by tenant, schema name pattern and/or task name, and updated with "
+        "single UPDATE statements, without saving (and aligning) them one by one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["enable", "disable", "reschedule"])
+        parser.add_argument(
+            "--tenant",
+            action="append",
+            dest="tenants",
+            metavar="SCHEMA_NAME",
+            help="Only tasks of the tenant with this schema name (repeatable).",
+        )
+        parser.add_argument(
+            "--schema-pattern",
+            help="Only tasks of tenants whose schema name matches this shell-style "
+            "pattern, e.g. 'customer_*'.",
+        )
+        parser.add_argument(
+            "--task",
+            action="append",
+            dest="tasks",
+            metavar="TASK",
+            help="Only periodic tasks running this task, e.g. 'app.tasks.task' "
+            "(repeatable).",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Allow the action on every periodic task, if no filters are given.",
+        )
+        parser.add_argument(
+            "--crontab",
+            help="The new schedule for `reschedule`, as a crontab expression "
+            "'minute hour day_of_month month_of_year day_of_week'. It is evaluated in "
+            "the tenant's timezone for tasks that use it, and in UTC otherwise.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many periodic tasks would be changed.",
+        )
+
+    def handle(self, *args, **options):
+        periodic_tasks = self.get_queryset(options)
+        if options["action"] == "reschedule":
+            schedule = self.parse_crontab(options["crontab"])
+
+        if options["dry_run"]:
+            count = self.get_changed(periodic_tasks, options["action"]).count()
+            self.stdout.write(f"{count} periodic tasks would be {options['action']}d.")
+            return
+
+        with transaction.atomic():
+            if options["action"] == "reschedule":
+                count = self.reschedule(periodic_tasks, schedule)
+            else:
+                count = self.set_enabled(periodic_tasks, options["action"] == "enable")
+            if count and options["action"] != "disable":
+                # As in `align`, the tasks may be due at other times
+                get_periodic_task_tenant_link_model().objects.filter(
+                    periodic_task__in=periodic_tasks
+                ).exclude(next_run_at=None).update(next_run_at=None)
+            if count:
+                PeriodicTasks.update_changed()
+        self.stdout.write(
+            self.style.SUCCESS(f"{count} periodic tasks {options['action']}d.")
+        )
+
+    def get_queryset(self, options):
+        filters = Q()
+        if options["tenants"]:
+            filters &= Q(periodic_task_tenant_link__schema_name__in=options["tenants"])
+        if options["schema_pattern"]:
+            filters &= Q(
+                periodic_task_tenant_link__schema_name__regex=glob_to_regex(
+                    options["schema_pattern"]
+                )
+            )
+        if options["tasks"]:
+            filters &= Q(task__in=options["tasks"])
+        if not filters and not options["all"]:
+            raise CommandError(
+                "Give --tenant, --schema-pattern and/or --task, or --all to change "
+                "every periodic task."
+            )
+        return PeriodicTask.objects.filter(filters)
+
+    @staticmethod
+    def parse_crontab(expression):
+        if not expression:
+            raise CommandError("reschedule needs a --crontab expression.")
+        try:
+            minute, hour, day_of_month, month_of_year, day_of_week = expression.split()
+            schedule = crontab(
+                minute=minute,
+                hour=hour,
+                day_of_week=day_of_week,
+                day_of_month=day_of_month,
+                month_of_year=month_of_year,
+            )
+        except ValueError as e:
+            raise CommandError(f"Invalid crontab expression {expression!r}: {e}")
+        return schedule
+
+    @staticmethod
+    def get_changed(periodic_tasks, action):
+        """Return the tasks of `periodic_tasks` that `action` changes."""
+        if action == "reschedule":
+            # Only tasks with a tenant link get a crontab, see `reschedule`
+            return periodic_tasks.filter(periodic_task_tenant_link__isnull=False)
+        return periodic_tasks.exclude(enabled=action == "enable")
+
+    def set_enabled(self, periodic_tasks, enabled):
+        fields = {"enabled": enabled}
+        if not enabled:
+            # As when saving a disabled PeriodicTask
+            fields["last_run_at"] = None
+        return self.get_changed(
+            periodic_tasks, "enable" if enabled else "disable"
+        ).update(**fields)
+
+    @staticmethod
+    def reschedule(periodic_tasks, schedule):
+        """Point the tasks at a crontab for `schedule`, with one UPDATE per timezone.
+
+        As in `PeriodicTaskTenantLinkMixin.save`, tasks that use their tenant's
+        timezone get a crontab in that timezone, and all others one in UTC.
+        """
+        links = get_periodic_task_tenant_link_model().objects.filter(
+            periodic_task__in=periodic_tasks
+        )
+        timezones = {
+            tz if use_tenant_timezone else pytz.utc
+            for use_tenant_timezone, tz in links.values_list(
+                "use_tenant_timezone", "tenant_timezone"
+            ).distinct()
+        }
+        count = 0
+        for tz in timezones:
+            schedule.tz = tz
+            crontab_id = crontab_cache.get_id(schedule)
+            tz_filter = Q(
+                periodic_task_tenant_link__use_tenant_timezone=True,
+                periodic_task_tenant_link__tenant_timezone=tz,
+            )
+            if tz == pytz.utc:
+                tz_filter |= Q(periodic_task_tenant_link__use_tenant_timezone=False)
+            count += periodic_tasks.filter(tz_filter).update(
+                crontab_id=crontab_id,
+                interval=None,
+                solar=None,
+                clocked=None,
+            )
+        return count
+
+
+def glob_to_regex(pattern):
+    """Translate a shell-style pattern into an anchored database regular expression."""
+    return "^{}$".format(
+        "".join(
+            ".*" if char == "*" else "." if char == "?" else re.escape(char)
+            for char in pattern
+        )
+    )
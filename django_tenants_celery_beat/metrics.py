@@ -0,0 +1,259 @@
+"""Per-tenant metrics of tasks sent by `TenantDatabaseScheduler`.
+
+When the `TENANT_BEAT_METRICS_SINK` setting is set, beat stamps each message it sends
+with the time its entry was due (`_due_at`) and the time the message was sent
+(`_dispatched_at`), and workers record, for each tenant and task:
+
+- `dispatch_lag`: seconds from the entry being due to the tenant's message being
+  sent, which grows for tenants late in a large fan-out;
+- `queue_wait`: seconds from the message being sent (or its countdown ending) to a
+  worker starting the task;
+- `run_duration`: seconds the task took to run.
+
+Metrics are recorded to the sink, which is the dotted path of a class taking the
+`TENANT_BEAT_METRICS_OPTIONS` setting as keyword arguments, such as `MemorySink`,
+`StatsdSink` or `PrometheusTextfileSink`. A sink only needs a
+`record(metric, value, schema_name, task_name)` method.
+"""
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DUE_AT_HEADER = "_due_at"
+DISPATCHED_AT_HEADER = "_dispatched_at"
+
+METRICS = {
+    "dispatch_lag": "Seconds from a tenant task being due to it being sent by beat",
+    "queue_wait": "Seconds from a tenant task being sent to it starting on a worker",
+    "run_duration": "Seconds a tenant task took to run on a worker",
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class Histogram:
+    """Cumulative counts of the observed values not above each of `buckets`."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The last count is for values above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """Return `(upper bound, count of values not above it)` pairs."""
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class MemorySink:
+    """Keep a `Histogram` of each metric per tenant and task, in this process."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, metric, value, schema_name, task_name):
+        key = (metric, schema_name, task_name)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def get(self, metric, schema_name, task_name):
+        """Return the `Histogram` of `metric` for a tenant and task, or None."""
+        return self.histograms.get((metric, schema_name, task_name))
+
+
+class StatsdSink:
+    """Send each value as a StatsD timing, over UDP.
+
+    The metric is named `<prefix>.<metric>.<schema_name>.<task name>`, with any dots
+    in the task name replaced, or with `tags` set, `<prefix>.<metric>` tagged with the
+    tenant and task in the DogStatsD format.
+    """
+
+    def __init__(self, host="localhost", port=8125, prefix="tenant_beat", tags=False):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.tags = tags
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, metric, value, schema_name, task_name):
+        if self.tags:
+            line = (
+                f"{self.prefix}.{metric}:{value * 1000:.3f}|ms"
+                f"|#tenant:{schema_name},task:{task_name}"
+            )
+        else:
+            task_name = task_name.replace(".", "_")
+            line = (
+                f"{self.prefix}.{metric}.{schema_name}.{task_name}:"
+                f"{value * 1000:.3f}|ms"
+            )
+        try:
+            self.socket.sendto(line.encode(), self.address)
+        except OSError as exc:
+            logger.debug("Could not send metric %s: %r", line, exc)
+
+
+class PrometheusTextfileSink(MemorySink):
+    """Write histograms in the Prometheus text format, e.g. for node_exporter.
+
+    The file is replaced at most every `interval` seconds. Each worker process keeps
+    its own histograms, so `path` may contain `{pid}` to give each its own file.
+    """
+
+    def __init__(
+        self, path, interval=10, prefix="tenant_beat", buckets=DEFAULT_BUCKETS
+    ):
+        super().__init__(buckets=buckets)
+        self.path = path
+        self.interval = interval
+        self.prefix = prefix
+        self._written_at = None
+
+    def record(self, metric, value, schema_name, task_name):
+        super().record(metric, value, schema_name, task_name)
+        now = time.monotonic()
+        if self._written_at is None or now - self._written_at >= self.interval:
+            self._written_at = now
+            self.write()
+
+    def write(self):
+        """Replace the file with the current histograms."""
+        path = self.path.format(pid=os.getpid())
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or ".", prefix=".tenant_beat"
+        )
+        with os.fdopen(fd, "w") as f:
+            f.write(self.render())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        for metric, help_text in METRICS.items():
+            name = f"{self.prefix}_{metric}_seconds"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (key_metric, schema_name, task_name), histogram in histograms:
+                if key_metric != metric:
+                    continue
+                labels = f'tenant="{_escape(schema_name)}",task="{_escape(task_name)}"'
+                for bound, count in histogram.cumulative_counts():
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+_sink = None
+
+
+def get_sink():
+    """Return the sink configured by `TENANT_BEAT_METRICS_SINK`, or None."""
+    global _sink
+    sink_path = getattr(settings, "TENANT_BEAT_METRICS_SINK", None)
+    if sink_path is None:
+        return None
+    if _sink is None or _sink[0] != sink_path:
+        options = getattr(settings, "TENANT_BEAT_METRICS_OPTIONS", {})
+        _sink = (sink_path, import_string(sink_path)(**options))
+    return _sink[1]
+
+
+def stamp_headers(headers, due_at):
+    """Add the beat timestamps to the `headers` of a message about to be sent."""
+    headers[DUE_AT_HEADER] = due_at
+    headers[DISPATCHED_AT_HEADER] = time.time()
+
+
+def _get_header(request, name):
+    # As in tenant_schemas_celery, headers are merged with the request by some brokers
+    if request.headers and name in request.headers:
+        return request.headers[name]
+    return request.get(name)
+
+
+_started = {}
+
+
+def task_prerun(task_id=None, task=None, **kwargs):
+    """Record the dispatch lag and queue wait of a task sent by beat."""
+    sink = get_sink()
+    if sink is None or task is None:
+        return
+    dispatched_at = _get_header(task.request, DISPATCHED_AT_HEADER)
+    if dispatched_at is None:
+        return
+    now = time.time()
+    _started[task_id] = time.monotonic()
+    schema_name = _get_header(task.request, "_schema_name")
+    due_at = _get_header(task.request, DUE_AT_HEADER)
+    if due_at is not None:
+        sink.record(
+            "dispatch_lag", max(dispatched_at - due_at, 0), schema_name, task.name
+        )
+    ready_at = dispatched_at
+    eta = task.request.eta
+    if eta:
+        if isinstance(eta, str):
+            eta = datetime.fromisoformat(eta)
+        ready_at = max(ready_at, eta.timestamp())
+    sink.record("queue_wait", max(now - ready_at, 0), schema_name, task.name)
+
+
+def task_postrun(task_id=None, task=None, **kwargs):
+    """Record the run duration of a task sent by beat."""
+    started = _started.pop(task_id, None)
+    sink = get_sink()
+    if sink is None or task is None or started is None:
+        return
+    sink.record(
+        "run_duration",
+        time.monotonic() - started,
+        _get_header(task.request, "_schema_name"),
+        task.name,
+    )
+
+
+def connect_signals():
+    """Record metrics of the tasks run by this process's Celery workers."""
+    from celery import signals
+
+    signals.task_prerun.connect(task_prerun, weak=False)
+    signals.task_postrun.connect(task_postrun, weak=False)
+
+
+def disconnect_signals():
+    from celery import signals
+
+    signals.task_prerun.disconnect(task_prerun)
+    signals.task_postrun.disconnect(task_postrun)
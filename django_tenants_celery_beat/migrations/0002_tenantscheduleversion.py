@@ -0,0 +1,21 @@
+# Generated by Django 3.2.13 on 2026-10-17 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_tenants_celery_beat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TenantScheduleVersion',
+            fields=[
+                ('schema_name', models.CharField(max_length=63, primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('changed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
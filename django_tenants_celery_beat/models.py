@@ -1,15 +1,28 @@
 import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
 
-from django.db import models
-from django_celery_beat.models import PeriodicTask, CrontabSchedule
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Now
+from django_celery_beat.models import PeriodicTask, PeriodicTasks, CrontabSchedule
 import pytz
 import timezone_field
 
 from django.conf import settings
 from django_tenants.utils import get_tenant_model, get_public_schema_name
-from django_tenants_celery_beat.utils import get_periodic_task_tenant_link_model
-
+from django_tenants_celery_beat import notify
+from django_tenants_celery_beat.utils import (
+    generate_tenant_beat_schedule,
+    get_periodic_task_tenant_link_model,
+    sync_tenant_beat_schedule,
+    tenant_cache,
+    TenantInfo,
+)
 
+logger = logging.getLogger(__name__)
 
 timezone_field_kwargs = {
     "default": "UTC",
@@ -17,6 +30,59 @@ timezone_field_kwargs = {
 if getattr(settings, "TENANT_TIMEZONE_DISPLAY_GMT_OFFSET", False):
     timezone_field_kwargs["choices_display"] = "WITH_GMT_OFFSET"
 
+class CrontabCache:
+    """LRU cache of CrontabSchedule ids, keyed by their schedule and timezone.
+
+    Entries are only added once the transaction that looked them up has been
+    committed, so a rolled back CrontabSchedule is never cached, and the cache is
+    cleared whenever any CrontabSchedule is saved or deleted. That only happens in the
+    process making the change, so a cached id is checked by primary key before it is
+    reused, and dropped if another process has deleted its CrontabSchedule.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+
+    @staticmethod
+    def key(schedule):
+        return (
+            str(schedule._orig_minute),
+            str(schedule._orig_hour),
+            str(schedule._orig_day_of_week),
+            str(schedule._orig_day_of_month),
+            str(schedule._orig_month_of_year),
+            str(schedule.tz),
+        )
+
+    def get_id(self, schedule):
+        """Return the id of the CrontabSchedule for `schedule`, creating it if needed."""
+        key = self.key(schedule)
+        crontab_id = self._ids.get(key)
+        if crontab_id is not None:
+            if CrontabSchedule.objects.filter(pk=crontab_id).exists():
+                self._ids.move_to_end(key)
+                return crontab_id
+            del self._ids[key]
+        crontab = CrontabSchedule.from_schedule(schedule)
+        if not crontab.id:
+            crontab.save()
+        transaction.on_commit(partial(self._set, key, crontab.id))
+        return crontab.id
+
+    def _set(self, key, crontab_id):
+        self._ids[key] = crontab_id
+        self._ids.move_to_end(key)
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+
+    def clear(self, **kwargs):
+        self._ids.clear()
+
+
+crontab_cache = CrontabCache()
+
+
 class TenantTimezoneMixin(models.Model):
     timezone = timezone_field.TimeZoneField(**timezone_field_kwargs)
     class Meta:
@@ -35,73 +101,431 @@ class PeriodicTaskTenantLinkMixin(models.Model):
         related_name="periodic_task_tenant_link",
     )
     use_tenant_timezone = models.BooleanField(default=False)
+    all_tenants = models.BooleanField(default=False)
+    # Denormalised from the tenant, so that links can be found by schema name alone,
+    # and aligned without fetching the tenant (see `update_tenant_periodic_tasks`)
+    schema_name = models.CharField(max_length=63, blank=True, editable=False)
+    tenant_timezone = timezone_field.TimeZoneField(default="UTC", editable=False)
+    # Maintained by `TenantDatabaseScheduler.send_due_tasks`, and cleared whenever the
+    # PeriodicTask changes
+    next_run_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         abstract = True
 
+    class IndexedMeta:
+        """Opt-in Meta for concrete link models, with indexes for tenant lookups.
+
+        Use with `class Meta(PeriodicTaskTenantLinkMixin.IndexedMeta)`, then make and
+        run the migrations (see the README).
+        """
+
+        indexes = [
+            models.Index(
+                fields=["tenant", "use_tenant_timezone"],
+                name="dtcb_link_tenant_tz_idx",
+            ),
+            models.Index(
+                fields=["tenant", "periodic_task"], name="dtcb_link_tenant_task_idx"
+            ),
+            models.Index(
+                fields=["schema_name", "periodic_task"],
+                name="dtcb_link_schema_task_idx",
+            ),
+            models.Index(fields=["next_run_at"], name="dtcb_link_next_run_idx"),
+        ]
+
     def __str__(self):
         return f"{self.tenant} - {self.periodic_task}"
 
     def save(self, *args, **kwargs):
         """Make PeriodicTask tenant-aware.
 
-        Inserts correct `_schema_name` for `self.tenant` and into
-        `self.periodic_task.headers`.
+        Inserts correct `_schema_name` for `self.tenant` into `self.schema_name` and
+        `self.periodic_task.headers`, and copies the tenant's timezone into
+        `self.tenant_timezone`.
         If `self.periodic_task` uses a crontab schedule and the tenant timezone should
         be used, the crontab is adjusted to use the timezone of the tenant.
+        If `self.all_tenants` is set, the PeriodicTask is a template that the
+        `TenantDatabaseScheduler` fans out to every tenant schema when it is due.
+        The change is then published to beat, see `publish_change`, for the previous
+        tenant too if the PeriodicTask moved.
         """
         update_fields = ["headers"]
 
+        previous_schema_name = self.schema_name
+        # Not from `tenant_cache`, which may be out of date, as it is persisted here
+        tenant = self.tenant
+        self.schema_name = tenant.schema_name
+        self.tenant_timezone = tenant.timezone
         headers = json.loads(self.periodic_task.headers)
-        headers["_schema_name"] = self.tenant.schema_name
+        headers["_schema_name"] = self.schema_name
         self.use_tenant_timezone = headers.pop(
             "_use_tenant_timezone", self.use_tenant_timezone
         )
+        self.all_tenants = headers.pop("_all_tenants", self.all_tenants)
         self.periodic_task.headers = json.dumps(headers)
 
         if self.periodic_task.crontab is not None:
-            tz = self.tenant.timezone if self.use_tenant_timezone else pytz.utc
+            tz = tenant.timezone if self.use_tenant_timezone else pytz.utc
             schedule = self.periodic_task.crontab.schedule
             if schedule.tz != tz:
                 schedule.tz = tz
-                crontab = CrontabSchedule.from_schedule(schedule)
-                if not crontab.id:
-                    crontab.save()
-                self.periodic_task.crontab = crontab
+                self.periodic_task.crontab_id = crontab_cache.get_id(schedule)
                 update_fields.append("crontab")
 
-        self.periodic_task.save(update_fields=update_fields)
+        # Already aligned, and published below, so `align` skips this save
+        self.periodic_task._saving_tenant_link = True
+        try:
+            self.periodic_task.save(update_fields=update_fields)
+        finally:
+            del self.periodic_task._saving_tenant_link
+        # The schedule or tenant may have changed
+        self.next_run_at = None
         super().save(*args, **kwargs)
+        publish_change(self.periodic_task_id, self.schema_name)
+        if previous_schema_name and previous_schema_name != self.schema_name:
+            publish_change(self.periodic_task_id, previous_schema_name)
+
+    def get_tenant_info(self):
+        """Return the tenant's `TenantInfo`, without a query if possible.
+
+        The tenant is used if it has already been fetched, otherwise its metadata is
+        taken from `tenant_cache`, which may be slightly out of date, so this is only
+        for reading. `save` uses the tenant itself.
+        """
+        if not type(self).tenant.field.is_cached(self):
+            tenant = tenant_cache.get_by_pk(self.tenant_id)
+            if tenant is not None:
+                return tenant
+        tenant = self.tenant
+        return TenantInfo(
+            tenant.pk, tenant.schema_name, tenant.timezone, getattr(tenant, "name", None)
+        )
+
 
+class BeatLeaderLock(models.Model):
+    """Leadership of a group of beat processes, held until `expires_at`.
 
-def align(instance, **kwargs):
+    Used by `leader.TableLeaderLock` where Postgres advisory locks are unavailable.
+    """
+
+    name = models.CharField(max_length=200, primary_key=True)
+    owner = models.CharField(max_length=200)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} - {self.owner}"
+
+
+class TenantScheduleVersion(models.Model):
+    """Version of a tenant's PeriodicTasks, incremented whenever one of them changes.
+
+    Used by `TenantDatabaseScheduler` with `TENANT_BEAT_PARTIAL_RELOAD` set, to reload
+    only the PeriodicTasks of the tenants whose version advanced.
+    """
+
+    schema_name = models.CharField(max_length=63, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    changed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.schema_name} - {self.version}"
+
+    @classmethod
+    def bump(cls, schema_name):
+        """Increment the version of tenant `schema_name`."""
+        if cls.objects.filter(schema_name=schema_name).update(
+            version=models.F("version") + 1, changed_at=Now()
+        ):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(schema_name=schema_name, version=1, changed_at=Now())
+        except IntegrityError:
+            # Created by a concurrent change
+            cls.objects.filter(schema_name=schema_name).update(
+                version=models.F("version") + 1, changed_at=Now()
+            )
+
+
+# PeriodicTask fields saved by the beat scheduler after each run
+SCHEDULER_FIELDS = frozenset(["last_run_at", "total_run_count"])
+
+
+def align(instance, created=False, update_fields=None, **kwargs):
     """Ensure PeriodicTask `instance` is aligned with its tenant.
 
     If no PeriodicTaskTenantLink is attached, the headers dict determines how to
     create the tenant link (if not present or missing the `_schema_name` key, use
     `public`). Otherwise, the PeriodicTaskTenantLink is used to set the headers if
     they are not already set.
+
+    Saves that only update the fields the beat scheduler records runs with (see
+    `SCHEDULER_FIELDS`) cannot affect the alignment, so they are skipped, as are
+    saves made by the link's own `save`, which aligns and publishes itself. Otherwise,
+    the link's denormalised `schema_name` is compared against the headers, so the
+    tenant is only fetched if the link needs saving. Any other change may change when
+    the task is next due, so the link's `next_run_at` is cleared, and is published to
+    beat (see `publish_change`).
     """
-    if hasattr(instance, "periodic_task_tenant_link"):
+    if update_fields is not None and SCHEDULER_FIELDS.issuperset(update_fields):
+        return
+    if getattr(instance, "_saving_tenant_link", False):
+        return
+
+    headers = json.loads(instance.headers)
+    tenant_link = None if created else _get_tenant_link(instance)
+    if tenant_link is not None:
         # Ensure that the headers are present and aligned
-        headers = json.loads(instance.headers)
-        tenant_link = instance.periodic_task_tenant_link
         if (
             "_use_tenant_timezone" in headers
-            or headers.get("_schema_name") != tenant_link.tenant.schema_name
+            or "_all_tenants" in headers
+            or headers.get("_schema_name")
+            != (tenant_link.schema_name or tenant_link.get_tenant_info().schema_name)
         ):
-            instance.periodic_task_tenant_link.save()
+            tenant_link.save()
+        else:
+            if tenant_link.next_run_at is not None:
+                tenant_link.next_run_at = None
+                type(tenant_link).objects.filter(pk=tenant_link.pk).update(
+                    next_run_at=None
+                )
+            publish_change(instance.pk, headers["_schema_name"])
     else:
-        headers = json.loads(instance.headers)
         schema_name = headers.get("_schema_name", get_public_schema_name())
         use_tenant_timezone = headers.get("_use_tenant_timezone", False)
+        all_tenants = headers.get("_all_tenants", False)
+        # Assumes the public schema has been created already
+        # As long as no fiddling goes on, these tenants should always exist
+        tenant = tenant_cache.get(schema_name)
         get_periodic_task_tenant_link_model().objects.create(
             periodic_task=instance,
-            # Assumes the public schema has been created already
-            # As long as no fiddling goes on, these tenants should always exist
-            tenant=get_tenant_model().objects.get(schema_name=schema_name),
+            tenant_id=(
+                tenant.pk
+                if tenant is not None
+                else get_tenant_model().objects.get(schema_name=schema_name).pk
+            ),
             use_tenant_timezone=use_tenant_timezone,
+            all_tenants=all_tenants,
+        )
+
+
+def publishes_changes():
+    """Return whether changes to single PeriodicTasks are published to beat."""
+    return notify.enabled() or getattr(settings, "TENANT_BEAT_PARTIAL_RELOAD", False)
+
+
+def publish_change(periodic_task_id, schema_name):
+    """Let beat know that a PeriodicTask of tenant `schema_name` changed.
+
+    The change is published with `notify`, and with `TENANT_BEAT_PARTIAL_RELOAD` set,
+    the tenant's `TenantScheduleVersion` is incremented.
+    """
+    notify.publish(periodic_task_id, schema_name)
+    if schema_name and getattr(settings, "TENANT_BEAT_PARTIAL_RELOAD", False):
+        TenantScheduleVersion.bump(schema_name)
+
+
+_bulk_change = threading.local()
+
+
+@contextmanager
+def bulk_change():
+    """Mark the schedule as changed once, for all the PeriodicTasks changed within.
+
+    The PeriodicTasks saved or deleted within are neither marked as changed nor
+    published one by one.
+    """
+    _bulk_change.active = True
+    try:
+        yield
+    finally:
+        _bulk_change.active = False
+    PeriodicTasks.update_changed()
+
+
+def periodic_task_changed(instance, **kwargs):
+    """Mark the schedule as changed, unless the change is published to beat.
+
+    Replaces django-celery-beat's `PeriodicTasks.changed` receivers, so that when
+    changes are published (see `publishes_changes`), beat reloads only the
+    PeriodicTasks or tenants that changed rather than the whole schedule.
+    """
+    if not publishes_changes() and not getattr(_bulk_change, "active", False):
+        PeriodicTasks.changed(instance, **kwargs)
+
+
+def remove_periodic_task(instance, **kwargs):
+    """Publish the deletion of PeriodicTask `instance` to beat."""
+    if getattr(_bulk_change, "active", False):
+        return
+    publish_change(
+        instance.pk, json.loads(instance.headers or "{}").get("_schema_name")
+    )
+
+
+def _get_tenant_link(periodic_task):
+    """Return the tenant link of `periodic_task`, or None."""
+    link_cache = type(periodic_task).periodic_task_tenant_link.related
+    if link_cache.is_cached(periodic_task):
+        return link_cache.get_cached_value(periodic_task)
+    tenant_link = (
+        get_periodic_task_tenant_link_model()
+        .objects.filter(periodic_task_id=periodic_task.pk)
+        .first()
+    )
+    if tenant_link is not None:
+        # Also caches the link on periodic_task
+        tenant_link.periodic_task = periodic_task
+    return tenant_link
+
+
+def add_tenant_periodic_tasks(instance, created, raw=False, **kwargs):
+    """Create the PeriodicTasks for a newly created tenant.
+
+    The tenant's entries from the `all_tenants` entries of the beat_schedule (see
+    `generate_tenant_beat_schedule`) are synced with the database in one go, so the
+    new tenant is scheduled without restarting beat. If no beat_schedule has been
+    generated in this process, e.g. in a web process, they are copied from the
+    existing tenants' PeriodicTasks instead, see `copy_tenant_periodic_tasks`.
+    """
+    if not created or raw or instance.schema_name == get_public_schema_name():
+        return
+    beat_schedule = generate_tenant_beat_schedule(instance.schema_name)
+    if beat_schedule:
+        sync_tenant_beat_schedule(beat_schedule=beat_schedule)
+    else:
+        copy_tenant_periodic_tasks(instance)
+
+
+def copy_tenant_periodic_tasks(tenant):
+    """Create the PeriodicTasks of new tenant `tenant` from the existing tenants'.
+
+    The `all_tenants` entries are taken to be the PeriodicTasks named
+    `"<schema_name>: <name>"` that the first two other tenants (by schema name) both
+    have, so a tenant's own PeriodicTasks are only copied if there is a single other
+    tenant. The copies are aligned with `tenant` when saved, see `align`.
+    """
+    public_schema_name = get_public_schema_name()
+    schema_names = sorted(
+        schema_name
+        for schema_name in tenant_cache.all()
+        if schema_name not in (public_schema_name, tenant.schema_name)
+    )[:2]
+    if not schema_names:
+        return
+    periodic_tasks = {schema_name: {} for schema_name in schema_names}
+    for periodic_task in PeriodicTask.objects.filter(
+        periodic_task_tenant_link__schema_name__in=schema_names,
+        periodic_task_tenant_link__all_tenants=False,
+    ).select_related("periodic_task_tenant_link"):
+        schema_name = periodic_task.periodic_task_tenant_link.schema_name
+        prefix = f"{schema_name}: "
+        if periodic_task.name.startswith(prefix):
+            periodic_tasks[schema_name][periodic_task.name[len(prefix):]] = periodic_task
+    names = set.intersection(*(set(tasks) for tasks in periodic_tasks.values()))
+    if not names:
+        return
+    logger.warning(
+        "No beat_schedule generated in this process: copying PeriodicTasks %s of "
+        "tenant %r for new tenant %r",
+        sorted(names),
+        schema_names[0],
+        tenant.schema_name,
+    )
+    with bulk_change():
+        for name in sorted(names):
+            source = periodic_tasks[schema_names[0]][name]
+            headers = {
+                **json.loads(source.headers or "{}"),
+                "_schema_name": tenant.schema_name,
+                "_use_tenant_timezone": (
+                    source.periodic_task_tenant_link.use_tenant_timezone
+                ),
+            }
+            periodic_task = PeriodicTask(
+                **{
+                    field.attname: getattr(source, field.attname)
+                    for field in PeriodicTask._meta.concrete_fields
+                    if not field.primary_key
+                }
+            )
+            periodic_task.name = f"{tenant.schema_name}: {name}"
+            periodic_task.headers = json.dumps(headers)
+            periodic_task.last_run_at = None
+            periodic_task.total_run_count = 0
+            periodic_task.save()
+
+
+def update_tenant_periodic_tasks(
+    instance, created, raw=False, update_fields=None, **kwargs
+):
+    """Realign the PeriodicTasks of a tenant whose schema name or timezone changed.
+
+    The links whose denormalised `schema_name` or `tenant_timezone` no longer match the
+    tenant are saved again, which also updates the `_schema_name` header and the
+    timezone of any crontabs using the tenant's timezone.
+    """
+    if created or raw:
+        return
+    if update_fields is not None and not {"schema_name", "timezone"} & set(
+        update_fields
+    ):
+        return
+    links = (
+        get_periodic_task_tenant_link_model()
+        .objects.filter(tenant=instance)
+        .filter(
+            ~models.Q(schema_name=instance.schema_name)
+            | ~models.Q(tenant_timezone=instance.timezone)
         )
+        .select_related("periodic_task__crontab")
+    )
+    for link in links:
+        link.tenant = instance
+        link.save()
+
+
+def collect_tenant_periodic_tasks(instance, **kwargs):
+    """Remember the PeriodicTasks of a tenant that is about to be deleted."""
+    instance._periodic_task_ids = list(
+        get_periodic_task_tenant_link_model()
+        .objects.filter(tenant=instance)
+        .values_list("periodic_task_id", flat=True)
+    )
+
+
+def remove_tenant_periodic_tasks(instance, **kwargs):
+    """Delete the PeriodicTasks of a deleted tenant.
+
+    Deleting the tenant only cascades to the tenant links, and the PeriodicTasks left
+    behind could no longer run. They are deleted along with anything else referring
+    to them, and the schedule is marked as changed once, see `bulk_change`.
+    """
+    periodic_task_ids = getattr(instance, "_periodic_task_ids", None)
+    if periodic_task_ids:
+        with bulk_change():
+            PeriodicTask.objects.filter(pk__in=periodic_task_ids).delete()
 
 
 models.signals.post_save.connect(align, sender=PeriodicTask)
+for signal in [models.signals.pre_save, models.signals.pre_delete]:
+    signal.disconnect(PeriodicTasks.changed, sender=PeriodicTask)
+    signal.connect(periodic_task_changed, sender=PeriodicTask)
+models.signals.post_delete.connect(remove_periodic_task, sender=PeriodicTask)
+models.signals.post_save.connect(crontab_cache.clear, sender=CrontabSchedule)
+models.signals.post_delete.connect(crontab_cache.clear, sender=CrontabSchedule)
+# The tenant cache must be cleared before the other tenant receivers run
+models.signals.post_save.connect(tenant_cache.clear, sender=settings.TENANT_MODEL)
+models.signals.post_delete.connect(tenant_cache.clear, sender=settings.TENANT_MODEL)
+models.signals.post_save.connect(add_tenant_periodic_tasks, sender=settings.TENANT_MODEL)
+models.signals.post_save.connect(
+    update_tenant_periodic_tasks, sender=settings.TENANT_MODEL
+)
+models.signals.pre_delete.connect(
+    collect_tenant_periodic_tasks, sender=settings.TENANT_MODEL
+)
+models.signals.post_delete.connect(
+    remove_tenant_periodic_tasks, sender=settings.TENANT_MODEL
+)
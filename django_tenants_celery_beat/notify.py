@@ -0,0 +1,102 @@
+"""Changes to PeriodicTasks published to beat with Postgres LISTEN/NOTIFY.
+
+When the `TENANT_BEAT_NOTIFY` setting is True and the database is Postgres, each
+saved or deleted PeriodicTask is published on the `TENANT_BEAT_NOTIFY_CHANNEL`
+channel as its id and tenant schema name, by `align`, the tenant link's `save` and
+`remove_periodic_task`. `TenantDatabaseScheduler` listens on the channel and reloads
+just those rows, and such changes no longer mark the whole schedule as changed (see
+`PeriodicTasks.last_change`). Other changes, such as to the schedule models or bulk
+changes made with `PeriodicTasks.update_changed`, still make beat reload the schedule
+in full.
+
+Notifications are only delivered once the transaction making the change commits, and
+are lost while beat is not listening, so beat reloads the schedule in full whenever
+it starts or restarts listening.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHANNEL = "django_tenants_celery_beat"
+
+
+def enabled(using="default"):
+    """Return whether PeriodicTask changes are published, see the module docstring."""
+    return (
+        getattr(settings, "TENANT_BEAT_NOTIFY", False)
+        and connections[using].vendor == "postgresql"
+    )
+
+
+def get_channel():
+    return getattr(settings, "TENANT_BEAT_NOTIFY_CHANNEL", DEFAULT_CHANNEL)
+
+
+def publish(periodic_task_id, schema_name, using="default"):
+    """Publish a change to the PeriodicTask with `periodic_task_id`, if enabled."""
+    if not enabled(using):
+        return
+    payload = json.dumps({"id": periodic_task_id, "schema_name": schema_name})
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [get_channel(), payload])
+
+
+class ScheduleListener:
+    """Listen for published PeriodicTask changes on a connection of its own.
+
+    The connection is kept open between ticks, unlike Django's, so that no
+    notification is missed while beat is running.
+    """
+
+    def __init__(self, channel=None, using="default"):
+        self.channel = channel or get_channel()
+        self.using = using
+        self.connection = None
+
+    def poll(self):
+        """Return the ids of the PeriodicTasks changed since the last poll.
+
+        Returns None instead when the listener has just started listening, as
+        changes may have been missed, and the schedule should be reloaded in full.
+        Any error closes the connection, to listen again at the next poll.
+        """
+        try:
+            if self.connection is None:
+                self.listen()
+                return None
+            with self.connection.wrap_database_errors:
+                dbapi_connection = self.connection.connection
+                dbapi_connection.poll()
+                notifies, dbapi_connection.notifies[:] = (
+                    list(dbapi_connection.notifies),
+                    [],
+                )
+        except (DatabaseError, InterfaceError) as exc:
+            logger.warning("Could not listen on %r: %r", self.channel, exc)
+            self.close()
+            return set()
+        ids = set()
+        for notify in notifies:
+            try:
+                ids.add(int(json.loads(notify.payload)["id"]))
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Ignoring notification %r", notify.payload)
+        return ids
+
+    def listen(self):
+        wrapper = connections[self.using]
+        self.connection = type(wrapper)(dict(wrapper.settings_dict), self.using)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.connection.ops.quote_name(self.channel)}")
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except (DatabaseError, InterfaceError):
+                pass
+            self.connection = None
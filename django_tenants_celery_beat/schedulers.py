@@ -0,0 +1,866 @@
+import heapq
+import json
+import time
+from collections import deque
+from copy import copy
+from datetime import timedelta
+from itertools import islice
+
+from celery.beat import BeatLazyFunc, event_t
+from celery.utils.log import get_logger
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, InterfaceError, close_old_connections
+from django.db.models import F, Min, Q
+from django.utils import timezone
+from django_celery_beat.schedulers import DatabaseScheduler, ModelEntry
+from django_celery_beat.utils import NEVER_CHECK_TIMEOUT
+from kombu.utils.json import loads
+from django_tenants.utils import get_public_schema_name
+
+from django_tenants_celery_beat import notify
+from django_tenants_celery_beat.leader import DEFAULT_LOCK_NAME, get_leader_lock
+from django_tenants_celery_beat.metrics import stamp_headers
+from django_tenants_celery_beat.tasks import FAN_OUT_TASK
+from django_tenants_celery_beat.utils import (
+    get_periodic_task_tenant_link_model,
+    spread_offset,
+    sync_tenant_beat_schedule,
+    tenant_cache,
+)
+
+# Maximum number of fan-out messages sent per scheduler tick
+DEFAULT_FANOUT_CHUNK_SIZE = 1000
+# Maximum number of PeriodicTask rows written back per UPDATE on sync
+SYNC_BATCH_SIZE = 1000
+# Seconds between checks of the leader lock, and so the standbys' failover time
+DEFAULT_LEADER_INTERVAL = 1
+# Seconds that tenant versions are checked back for, beyond the previous check, to
+# allow for clock skew and changes committed late
+DEFAULT_PARTIAL_RELOAD_MARGIN = 60
+
+logger = get_logger(__name__)
+debug, info, warning, error = logger.debug, logger.info, logger.warning, logger.error
+
+
+class TenantModelEntry(ModelEntry):
+    """Scheduler entry taken from a tenant-aware PeriodicTask row.
+
+    Entries whose PeriodicTaskTenantLink has `all_tenants` set are templates: when due,
+    they are sent once per tenant schema rather than once for the linked tenant.
+    If `timezone` is given, the entry's crontab is evaluated in that timezone and the
+    template is only sent to tenants in that timezone. If `shard` is given, as a tuple
+    `(shard_index, shard_count)`, the template is only sent to that shard's tenants.
+    Templates with a `_chunk_size` header are sent as a single coordinator message,
+    see `TenantDatabaseScheduler.send_coordinator`.
+    """
+
+    def __init__(self, model, app=None, timezone=None, shard=None):
+        super().__init__(model, app=app)
+        link = getattr(model, "periodic_task_tenant_link", None)
+        self.all_tenants = link is not None and link.all_tenants
+        self.timezone = timezone
+        self.shard = shard
+        if timezone is not None:
+            self.name = f"{model.name} [{timezone}]"
+            self.schedule = copy(self.schedule)
+            self.schedule.tz = timezone
+        self.spread_seconds = self.options["headers"].pop("_spread_seconds", None)
+        self.chunk_size = self.options["headers"].pop("_chunk_size", None)
+        if self.spread_seconds and not self.fans_out:
+            self.options = self._spread_options(
+                self.options, self.options["headers"].get("_schema_name", "")
+            )
+
+    def __next__(self):
+        self.model.last_run_at = self._default_now()
+        self.model.total_run_count += 1
+        self.model.no_changes = True
+        return self.__class__(
+            self.model, app=self.app, timezone=self.timezone, shard=self.shard
+        )
+
+    next = __next__
+
+    @property
+    def fans_out(self):
+        """Whether the entry is sent to several tenants when due."""
+        return self.all_tenants
+
+    @property
+    def coordinated(self):
+        """Whether the entry is sent to its tenants by a worker, in chunks."""
+        return self.all_tenants and bool(self.chunk_size)
+
+    @property
+    def run_models(self):
+        """The PeriodicTask rows whose runs this entry records."""
+        return [self.model]
+
+    def tenant_schema_names(self):
+        """Return the schema names that a template entry is sent to."""
+        public_schema_name = get_public_schema_name()
+        return [
+            schema_name
+            for schema_name, tenant in tenant_cache.all().items()
+            if schema_name != public_schema_name
+            and (self.timezone is None or tenant.timezone == self.timezone)
+            and in_shard(tenant.pk, self.shard)
+        ]
+
+    def tenant_options(self, schema_name):
+        """Return the message options for sending this entry to `schema_name`."""
+        options = {
+            **self.options,
+            "headers": {**self.options["headers"], "_schema_name": schema_name},
+        }
+        if self.spread_seconds:
+            options = self._spread_options(options, schema_name)
+        return options
+
+    def _spread_options(self, options, schema_name):
+        # Delay the tenant's run, and its expiry along with it
+        offset = spread_offset(schema_name, self.spread_seconds)
+        options = {**options, "countdown": offset}
+        if isinstance(options.get("expires"), (int, float)):
+            options["expires"] += offset
+        return options
+
+
+class TenantBucketEntry(TenantModelEntry):
+    """Scheduler entry for tenant PeriodicTasks that fire at exactly the same time.
+
+    `members` are PeriodicTask rows that only differ by tenant: the same task,
+    arguments, options and CrontabSchedule (and so timezone). The entry is due when
+    the first of them would be, and is sent to each of their tenants. It runs when the
+    most recently run member is next due, so a missed run of a single member is not
+    caught up, but no member is ever sent twice.
+    """
+
+    def __init__(self, model, app=None, members=()):
+        super().__init__(model, app=app)
+        self.members = members
+        self.name = f"{model.name} (+{len(members) - 1} tenants)"
+        self.last_run_at = max(
+            member.last_run_at or self.last_run_at for member in members
+        )
+        self.schema_names = [
+            loads(member.headers or "{}").get("_schema_name") for member in members
+        ]
+
+    def __next__(self):
+        now = self._default_now()
+        for member in self.members:
+            member.last_run_at = now
+            member.total_run_count += 1
+            member.no_changes = True
+        return self.__class__(self.model, app=self.app, members=self.members)
+
+    next = __next__
+
+    @property
+    def fans_out(self):
+        return True
+
+    @property
+    def run_models(self):
+        return self.members
+
+    def tenant_schema_names(self):
+        return self.schema_names
+
+
+class Fanout:
+    """The pending messages of a due entry that is sent to several tenants.
+
+    If `due_at` is given, the messages are stamped with it and the time they are sent,
+    see `metrics`.
+    """
+
+    def __init__(self, entry, app, due_at=None):
+        self.entry = entry
+        self.due_at = due_at
+        self.task = app.tasks.get(entry.task)
+        self.args = [v() if isinstance(v, BeatLazyFunc) else v for v in entry.args]
+        self.kwargs = {
+            k: v() if isinstance(v, BeatLazyFunc) else v
+            for k, v in entry.kwargs.items()
+        }
+        self.schema_names = iter(entry.tenant_schema_names())
+        self.sent = 0
+
+    def send(self, scheduler, schema_name, producer=None):
+        options = self.entry.tenant_options(schema_name)
+        if self.due_at is not None:
+            stamp_headers(options["headers"], self.due_at)
+        if self.task:
+            self.task.apply_async(
+                self.args, self.kwargs, producer=producer, **options
+            )
+        else:
+            scheduler.send_task(
+                self.entry.task, self.args, self.kwargs, producer=producer, **options
+            )
+        self.sent += 1
+
+
+class TenantDatabaseScheduler(DatabaseScheduler):
+    """Database-backed beat scheduler with support for tenant template entries.
+
+    A template PeriodicTask (see the `template` tenancy option of
+    `generate_beat_schedule`) is held as a single schedule entry, or one entry per
+    tenant timezone if it uses the tenants' timezones, and only expanded into one
+    message per tenant when it is due. The number of rows the scheduler loads is then
+    proportional to the number of task definitions rather than tenants x tasks.
+
+    Entries are kept in a min-heap keyed by their next run time, which is computed by
+    each entry's schedule and so respects crontabs localised to a tenant's timezone.
+    The heap is only rebuilt when the schedule is reloaded from the database, so each
+    tick costs O(due * log n) rather than O(n).
+
+    The `beat_schedule` is synced with the database in bulk on startup, see
+    `sync_tenant_beat_schedule`.
+
+    If the `TENANT_BEAT_BUCKET_BY_TIMEZONE` setting is True, tenant PeriodicTasks that
+    only differ by tenant and share a CrontabSchedule (and so a timezone) are held as
+    a single entry that is sent to all of their tenants, see `TenantBucketEntry`.
+    With tenants using their own timezones, this means one entry per task and
+    timezone rather than per task and tenant.
+
+    Entries sent to several tenants are published in chunks of
+    `TENANT_BEAT_FANOUT_CHUNK_SIZE` messages per tick, see `send_fanout_chunk`.
+
+    Runs are buffered in memory and written back to the database in bulk every
+    `sync_every` seconds or `sync_every_tasks` tasks, see `sync`.
+
+    Tenants can be split between several beat processes by setting
+    `TENANT_BEAT_SHARD_COUNT` to the number of processes, and
+    `TENANT_BEAT_SHARD_INDEX` to a different number from 0 up to that for each of
+    them. Each process then only loads the PeriodicTasks of the tenants whose id
+    modulo the shard count is its shard index, and sends templates only to those
+    tenants. Only shard 0 syncs the `beat_schedule` and installs the default entries.
+    A template's last run is kept per shard across reloads, but only in memory, so a
+    shard that restarts takes the last run recorded by any shard.
+
+    With `TENANT_BEAT_LEADER_ELECTION` set, several processes can run for the same
+    shard, and only the one holding the leader lock (see `leader`) sends tasks. The
+    others check the lock every `TENANT_BEAT_LEADER_INTERVAL` seconds, and whichever
+    takes it over reloads the schedule from the database, without syncing the
+    `beat_schedule` again.
+
+    With `TENANT_BEAT_DUE_QUERY` set, tenant tasks other than templates are not held
+    in memory at all, but fetched by their link's `next_run_at` when due, see
+    `send_due_tasks`.
+
+    With `TENANT_BEAT_NOTIFY` set on Postgres, the PeriodicTasks saved or deleted
+    since the last tick are published to the scheduler (see `notify`), which reloads
+    only those rows, see `apply_changes`. With `TENANT_BEAT_PARTIAL_RELOAD` set, on
+    any database, changes increment the version of their tenant instead, and the
+    scheduler reloads only the tenants whose version advanced, see
+    `reload_changed_tenants`. Otherwise, any change makes the scheduler reload the
+    whole schedule, once it has polled `PeriodicTasks.last_change`.
+    """
+
+    Entry = TenantModelEntry
+    BucketEntry = TenantBucketEntry
+
+    _heap_schedule = None
+
+    def __init__(self, *args, shard_index=None, shard_count=None, **kwargs):
+        self._fanouts = deque()
+        self.fanout_chunk_size = getattr(
+            settings, "TENANT_BEAT_FANOUT_CHUNK_SIZE", DEFAULT_FANOUT_CHUNK_SIZE
+        )
+        if shard_count is None:
+            shard_count = getattr(settings, "TENANT_BEAT_SHARD_COUNT", None)
+        if shard_index is None:
+            shard_index = getattr(settings, "TENANT_BEAT_SHARD_INDEX", 0)
+        if shard_count is not None and shard_count > 1:
+            if not 0 <= shard_index < shard_count:
+                raise ImproperlyConfigured(
+                    f"TENANT_BEAT_SHARD_INDEX must be from 0 to {shard_count - 1}"
+                )
+            self.shard = (shard_index, shard_count)
+        else:
+            self.shard = None
+        self.due_query = getattr(settings, "TENANT_BEAT_DUE_QUERY", False)
+        self.stamp_metrics = bool(getattr(settings, "TENANT_BEAT_METRICS_SINK", None))
+        self.is_leader = False
+        self.leader_lock = None
+        self.leader_interval = getattr(
+            settings, "TENANT_BEAT_LEADER_INTERVAL", DEFAULT_LEADER_INTERVAL
+        )
+        self._leader_checked_at = None
+        if getattr(settings, "TENANT_BEAT_LEADER_ELECTION", False):
+            lock_name = DEFAULT_LOCK_NAME
+            if self.shard is not None:
+                lock_name += ":shard{}of{}".format(*self.shard)
+            self.leader_lock = get_leader_lock(lock_name)
+        self.listener = notify.ScheduleListener() if notify.enabled() else None
+        self.partial_reload = getattr(settings, "TENANT_BEAT_PARTIAL_RELOAD", False)
+        self.partial_reload_margin = getattr(
+            settings, "TENANT_BEAT_PARTIAL_RELOAD_MARGIN", DEFAULT_PARTIAL_RELOAD_MARGIN
+        )
+        self._tenant_versions = {}
+        self._versions_checked_at = None
+        super().__init__(*args, **kwargs)
+
+    def setup_schedule(self):
+        if not self.lead():
+            # The leader has synced the beat_schedule
+            return
+        if self.shard is not None and self.shard[0] != 0:
+            # Shard 0 syncs the beat_schedule for all shards
+            return
+        sync_tenant_beat_schedule(self.app)
+        self.install_default_entries(self.schedule)
+
+    def install_default_entries(self, data):
+        # The beat_schedule has already been synced, and takes precedence
+        if "celery.backend_cleanup" not in self.app.conf.beat_schedule:
+            super().install_default_entries(data)
+
+    def update_from_dict(self, mapping):
+        super().update_from_dict(mapping)
+        if self.due_query:
+            # Only saved, as they are fetched when due, see `schedule_models`
+            for name in mapping:
+                entry = self._schedule.get(name)
+                link = entry and getattr(entry.model, "periodic_task_tenant_link", None)
+                if link is not None and not link.all_tenants:
+                    del self._schedule[name]
+
+    def all_as_schedule(self):
+        debug("TenantDatabaseScheduler: Fetching database schedule")
+        return self.schedule_entries(self.schedule_models())
+
+    def schedule_models(self):
+        """Return the queryset of the PeriodicTasks held in the schedule."""
+        models = self.filter_shard(
+            self.Model.objects.enabled().select_related("periodic_task_tenant_link")
+        )
+        if self.due_query:
+            # Tenant tasks are only fetched once due, see `send_due_tasks`
+            models = models.exclude(periodic_task_tenant_link__all_tenants=False)
+        return models
+
+    def schedule_entries(self, models):
+        """Return the schedule entries of PeriodicTasks `models`, keyed by name."""
+        s = {}
+        timezones = None
+        buckets = {}
+        bucket_by_timezone = getattr(settings, "TENANT_BEAT_BUCKET_BY_TIMEZONE", False)
+        for model in models:
+            try:
+                link = getattr(model, "periodic_task_tenant_link", None)
+                if (
+                    link is not None
+                    and link.all_tenants
+                    and link.use_tenant_timezone
+                    and model.crontab_id is not None
+                ):
+                    if timezones is None:
+                        timezones = self._tenant_timezones()
+                    for tz in timezones:
+                        entry = self.Entry(
+                            model, app=self.app, timezone=tz, shard=self.shard
+                        )
+                        s[entry.name] = entry
+                elif (
+                    bucket_by_timezone
+                    and link is not None
+                    and not link.all_tenants
+                    and model.crontab_id is not None
+                    and not model.one_off
+                ):
+                    buckets.setdefault(self._bucket_key(model), []).append(model)
+                else:
+                    s[model.name] = self.Entry(model, app=self.app, shard=self.shard)
+            except ValueError:
+                pass
+        for members in buckets.values():
+            try:
+                if len(members) == 1:
+                    s[members[0].name] = self.Entry(members[0], app=self.app)
+                else:
+                    entry = self.BucketEntry(members[0], app=self.app, members=members)
+                    s[entry.name] = entry
+            except ValueError:
+                pass
+        if self.shard is not None and self._schedule:
+            # Every shard records its template runs in the same row, so the row's
+            # `last_run_at` may be another shard's: this shard's own is kept instead
+            for name, entry in s.items():
+                previous = self._schedule.get(name)
+                if entry.all_tenants and previous is not None:
+                    entry.last_run_at = entry.model.last_run_at = previous.last_run_at
+        return s
+
+    def filter_shard(self, models):
+        """Filter PeriodicTask queryset `models` down to those of this shard, if any.
+
+        Templates are loaded by every shard, and sent to the shard's tenants.
+        """
+        if self.shard is None:
+            return models
+        shard_index, shard_count = self.shard
+        return models.annotate(
+            tenant_shard=F("periodic_task_tenant_link__tenant_id") % shard_count
+        ).filter(
+            Q(tenant_shard=shard_index) | Q(periodic_task_tenant_link__all_tenants=True)
+        )
+
+    @staticmethod
+    def _bucket_key(model):
+        headers = loads(model.headers or "{}")
+        headers.pop("_schema_name", None)
+        return (
+            model.task,
+            model.args,
+            model.kwargs,
+            model.queue,
+            model.exchange,
+            model.routing_key,
+            model.priority,
+            model.expires,
+            model.expire_seconds,
+            model.start_time,
+            model.crontab_id,
+            json.dumps(headers, sort_keys=True),
+        )
+
+    def tick(self, event_t=event_t, min=min, heappop=heapq.heappop,
+             heappush=heapq.heappush):
+        """Run a tick - one iteration of the scheduler.
+
+        Sends the next chunk of any pending fan-out messages, then every entry that
+        is due, popping them off the heap in order of their next run time. Unlike
+        `Scheduler.tick`, the schedule is not compared entry by entry against the
+        previous one: the heap is only repopulated when `DatabaseScheduler` has
+        replaced the schedule after a change.
+
+        Returns:
+            float: preferred delay in seconds for next call.
+        """
+        max_interval = self.max_interval
+
+        if not self.lead():
+            return min(self.leader_interval, max_interval)
+
+        if self._fanouts:
+            self.send_fanout_chunk(producer=self.producer)
+
+        if self.listener is not None:
+            self.apply_changes()
+        if self.partial_reload:
+            self.reload_changed_tenants()
+        schedule = self.schedule
+        if self._heap is None or schedule is not self._heap_schedule:
+            self._heap_schedule = schedule
+            self._heap_invalidated = False
+            self.populate_heap()
+
+        H = self._heap
+        delay = 0 if H else max_interval
+        # Each entry is sent at most once per tick, even if it is due again already
+        for _ in range(len(H)):
+            event = H[0]
+            entry = event[2]
+            is_due, next_time_to_run = self.is_due(entry)
+            if not is_due:
+                # As in `Scheduler.tick`, a delay of 0 is kept rather than maxed out
+                next_time_to_run = self.adjust(next_time_to_run)
+                delay = min(
+                    max_interval if next_time_to_run is None else next_time_to_run,
+                    max_interval,
+                )
+                break
+            heappop(H)
+            next_entry = self.reserve(entry)
+            self.apply_entry(entry, producer=self.producer, due_at=event[0])
+            heappush(
+                H,
+                event_t(self._when(next_entry, next_time_to_run), event[1], next_entry),
+            )
+        if self.due_query:
+            delay = min(delay, self.send_due_tasks(producer=self.producer))
+        return 0 if self._fanouts else delay
+
+    def reserve(self, entry):
+        new_entry = super().reserve(entry)
+        # Unlike `DatabaseScheduler`, keep the run in the schedule, as the heap is
+        # rebuilt from it after a partial reload, see `reload_entries`
+        if self._schedule is not None and entry.name in self._schedule:
+            self._schedule[entry.name] = new_entry
+        return new_entry
+
+    def apply_changes(self):
+        """Reload the PeriodicTasks published as changed since the last tick.
+
+        Only those rows are reloaded, see `reload_entries`. The schedule is reloaded
+        in full instead when the listener has just started listening, or if the rows
+        could not be reloaded, as the notifications are not received again.
+        """
+        ids = self.listener.poll()
+        if ids is None or (ids and not self.reload_entries(ids=ids)):
+            self._initial_read = True
+
+    def reload_changed_tenants(self):
+        """Reload the PeriodicTasks of the tenants whose version advanced.
+
+        The `TenantScheduleVersion`s changed since the previous check, less
+        `TENANT_BEAT_PARTIAL_RELOAD_MARGIN` seconds, are compared with the versions
+        seen then, and the tenants whose version is new or has advanced have their
+        entries reloaded.
+        """
+        from django_tenants_celery_beat.models import TenantScheduleVersion
+
+        now = timezone.now()
+        since = (self._versions_checked_at or now) - timedelta(
+            seconds=self.partial_reload_margin
+        )
+        try:
+            versions = dict(
+                TenantScheduleVersion.objects.filter(
+                    changed_at__gte=since
+                ).values_list("schema_name", "version")
+            )
+        except DatabaseError as exc:
+            logger.exception("Database error while checking versions: %r", exc)
+            return
+        except InterfaceError:
+            warning(
+                "TenantDatabaseScheduler: InterfaceError in reload_changed_tenants(), "
+                "waiting to retry in next call..."
+            )
+            return
+        schema_names = {
+            schema_name
+            for schema_name, version in versions.items()
+            if self._tenant_versions.get(schema_name) != version
+        }
+        if schema_names and not self.reload_entries(schema_names=schema_names):
+            return
+        self._tenant_versions = versions
+        self._versions_checked_at = now
+
+    def reload_entries(self, ids=(), schema_names=()):
+        """Reload the PeriodicTasks with `ids` or of tenants `schema_names`.
+
+        Only those rows are fetched, and their entries are replaced in the schedule,
+        or removed if the PeriodicTask was deleted or disabled. The schedule is
+        reloaded in full instead if it is due to be anyway, and with
+        `TENANT_BEAT_BUCKET_BY_TIMEZONE`, whose entries span several rows.
+
+        Returns:
+            bool: whether the changes were applied, or are covered by a full reload.
+        """
+        if self._initial_read:
+            return True
+        if getattr(settings, "TENANT_BEAT_BUCKET_BY_TIMEZONE", False):
+            self._initial_read = True
+            return True
+        # Write pending runs first, so that the reloaded rows include them
+        self.sync()
+        try:
+            entries = self.schedule_entries(
+                self.schedule_models().filter(
+                    Q(pk__in=ids)
+                    | Q(periodic_task_tenant_link__schema_name__in=schema_names)
+                )
+            )
+        except DatabaseError as exc:
+            logger.exception("Database error while reloading entries: %r", exc)
+            return False
+        except InterfaceError:
+            warning(
+                "TenantDatabaseScheduler: InterfaceError in reload_entries(), "
+                "waiting to retry in next call..."
+            )
+            return False
+        ids = set(ids) | {entry.model.pk for entry in entries.values()}
+        schedule = self._schedule
+        for name in [
+            name
+            for name, entry in schedule.items()
+            if entry.model.pk in ids
+            or entry.options["headers"].get("_schema_name") in schema_names
+        ]:
+            del schedule[name]
+        schedule.update(entries)
+        # Rebuilt from the updated schedule in `tick`
+        self._heap = None
+        debug("TenantDatabaseScheduler: Reloaded %d changed entries", len(entries))
+        return True
+
+    def send_due_tasks(self, producer=None):
+        """Send the tenant tasks whose `next_run_at` has passed.
+
+        Only the tenant tasks that are due, or whose next run is not known yet (new
+        and changed tasks, see `align`), are fetched, by their link's `next_run_at`.
+        Each is still checked with `is_due` before it is sent. The runs and the next
+        run times are written back straight away, so that the tasks are not fetched
+        again until they are next due.
+
+        Returns:
+            float: seconds until the next tenant task is due, at most `max_interval`.
+        """
+        link_model = get_periodic_task_tenant_link_model()
+        now = timezone.now()
+        try:
+            models = self.filter_shard(
+                self.Model.objects.enabled()
+                .filter(periodic_task_tenant_link__all_tenants=False)
+                .filter(
+                    Q(periodic_task_tenant_link__next_run_at__lte=now)
+                    | Q(periodic_task_tenant_link__next_run_at=None)
+                )
+                .select_related(
+                    "periodic_task_tenant_link",
+                    *(field for _, _, field in self.Entry.model_schedules),
+                )
+            )
+            runs, links = [], []
+            for model in models:
+                link = model.periodic_task_tenant_link
+                try:
+                    entry = self.Entry(model, app=self.app)
+                except ValueError as exc:
+                    # Not fetched again until the task is changed, see `align`
+                    logger.exception("Cannot load %s: %r", model.name, exc)
+                    link.next_run_at = now + timedelta(seconds=NEVER_CHECK_TIMEOUT)
+                    links.append(link)
+                    continue
+                is_due, next_time_to_run = entry.is_due()
+                if is_due:
+                    next_entry = next(entry)
+                    self.apply_entry(
+                        entry,
+                        producer=producer,
+                        due_at=link.next_run_at and link.next_run_at.timestamp(),
+                    )
+                    runs.append(next_entry.model)
+                    _, next_time_to_run = next_entry.is_due()
+                link.next_run_at = now + timedelta(seconds=next_time_to_run)
+                links.append(link)
+            self.Model._default_manager.bulk_update(
+                runs, ["last_run_at", "total_run_count"], batch_size=SYNC_BATCH_SIZE
+            )
+            link_model._default_manager.bulk_update(
+                links, ["next_run_at"], batch_size=SYNC_BATCH_SIZE
+            )
+            # Using the index alone, so disabled tasks and other shards' tenants may
+            # only wake the scheduler up early
+            next_run_at = link_model._default_manager.filter(
+                all_tenants=False, next_run_at__gt=now
+            ).aggregate(next_run_at=Min("next_run_at"))["next_run_at"]
+        except DatabaseError as exc:
+            logger.exception("Database error while sending due tasks: %r", exc)
+            return self.max_interval
+        except InterfaceError:
+            warning(
+                "TenantDatabaseScheduler: InterfaceError in send_due_tasks(), "
+                "waiting to retry in next call..."
+            )
+            return self.max_interval
+        if next_run_at is None:
+            return self.max_interval
+        return min(
+            max((next_run_at - timezone.now()).total_seconds(), 0), self.max_interval
+        )
+
+    def lead(self):
+        """Return whether this process is the leader, taking over if the lock is free.
+
+        Always true without leader election. The lock is checked at most once every
+        `leader_interval` seconds.
+        """
+        if self.leader_lock is None:
+            return True
+        now = time.monotonic()
+        if (
+            self._leader_checked_at is not None
+            and now - self._leader_checked_at < self.leader_interval
+        ):
+            return self.is_leader
+        self._leader_checked_at = now
+        was_leader, self.is_leader = self.is_leader, self.leader_lock.acquire()
+        if self.is_leader and not was_leader:
+            info("TenantDatabaseScheduler: Elected leader")
+            # Reload the schedule, with the runs recorded by the previous leader
+            self._initial_read = True
+        elif was_leader and not self.is_leader:
+            warning("TenantDatabaseScheduler: Lost leadership, standing by")
+            # The new leader sends these
+            self._fanouts.clear()
+            if self.listener is not None:
+                self.listener.close()
+        return self.is_leader
+
+    def close(self):
+        super().close()
+        if self.leader_lock is not None:
+            self.leader_lock.release()
+            self.is_leader = False
+        if self.listener is not None:
+            self.listener.close()
+
+    def apply_entry(self, entry, producer=None, due_at=None):
+        """Send a due entry, to each of its tenants if it fans out.
+
+        With metrics enabled, the messages are stamped with `due_at`, the timestamp
+        the entry was due at, or the current time if unknown, see `metrics`.
+        """
+        if self.stamp_metrics:
+            now = time.time()
+            due_at = now if due_at is None else min(due_at, now)
+        else:
+            due_at = None
+        if not entry.fans_out:
+            if due_at is not None:
+                stamp_headers(entry.options["headers"], due_at)
+            return super().apply_entry(entry, producer=producer)
+        if entry.coordinated:
+            return self.send_coordinator(entry, producer=producer, due_at=due_at)
+
+        info(
+            "TenantDatabaseScheduler: Sending due task %s (%s) to tenants",
+            entry.name,
+            entry.task,
+        )
+        self._fanouts.append(Fanout(entry, self.app, due_at=due_at))
+        self.send_fanout_chunk(producer=producer)
+
+    def send_coordinator(self, entry, producer=None, due_at=None):
+        """Send a due template as one `tasks.fan_out` message, for a worker to expand.
+
+        The template's message options (other than a non-numeric `expires`) and
+        headers are passed on to the messages sent to the tenants, and the
+        coordinator message itself is sent with the same options.
+        """
+        info(
+            "TenantDatabaseScheduler: Sending due task %s (%s) to a coordinator",
+            entry.name,
+            entry.task,
+        )
+        headers = dict(entry.options["headers"])
+        tenant_options = {
+            option: value
+            for option, value in entry.options.items()
+            if option != "headers"
+            and (option != "expires" or isinstance(value, (int, float)))
+        }
+        options = {**tenant_options, "headers": dict(headers)}
+        if due_at is not None:
+            stamp_headers(options["headers"], due_at)
+        try:
+            self.send_task(
+                FAN_OUT_TASK,
+                (
+                    entry.task,
+                    [v() if isinstance(v, BeatLazyFunc) else v for v in entry.args],
+                    {
+                        k: v() if isinstance(v, BeatLazyFunc) else v
+                        for k, v in entry.kwargs.items()
+                    },
+                ),
+                {
+                    "chunk_size": entry.chunk_size,
+                    "options": tenant_options,
+                    "headers": headers,
+                    "timezone": entry.timezone and str(entry.timezone),
+                    "shard": entry.shard,
+                    "spread_seconds": entry.spread_seconds,
+                },
+                producer=producer,
+                **options,
+            )
+        except Exception as exc:  # pylint: disable=broad-except
+            error("Message Error: %s", exc, exc_info=True)
+        self._tasks_since_sync += 1
+        if self.should_sync():
+            self._do_sync()
+
+    def send_fanout_chunk(self, producer=None):
+        """Send up to `fanout_chunk_size` pending fan-out messages.
+
+        Messages are sent in the order their entries became due, all with the same
+        producer, and the task, arguments and options of each entry are only prepared
+        once. Fan-outs larger than a chunk are spread over several ticks, so that beat
+        keeps checking the schedule while sending them.
+        """
+        sent = 0
+        while self._fanouts and sent < self.fanout_chunk_size:
+            fanout = self._fanouts[0]
+            chunk = list(islice(fanout.schema_names, self.fanout_chunk_size - sent))
+            for schema_name in chunk:
+                try:
+                    fanout.send(self, schema_name, producer=producer)
+                except Exception as exc:  # pylint: disable=broad-except
+                    error(
+                        "Message Error for tenant %s: %s",
+                        schema_name,
+                        exc,
+                        exc_info=True,
+                    )
+            sent += len(chunk)
+            if sent < self.fanout_chunk_size:
+                self._fanouts.popleft()
+                debug("%s sent to %d tenants", fanout.entry.task, fanout.sent)
+
+        self._tasks_since_sync += sent
+        if self.should_sync():
+            self._do_sync()
+
+    def sync(self):
+        """Write the runs of the entries sent since the last sync to the database.
+
+        Rather than fetching and saving each entry's PeriodicTask, the `last_run_at`
+        and `total_run_count` of all of them, including the members of bucket entries,
+        are written with `bulk_update` in batches of `SYNC_BATCH_SIZE` rows. If the
+        database is unavailable, the entries are kept and written at the next sync.
+        """
+        debug("TenantDatabaseScheduler: Writing entries...")
+        # The entries that were run, even if the schedule is reloaded meanwhile
+        schedule = self._schedule or {}
+        dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        failed = set()
+        try:
+            close_old_connections()
+            models = []
+            for name in dirty:
+                entry = schedule.get(name)
+                if entry is None:
+                    failed.add(name)
+                else:
+                    models += entry.run_models
+            self.Model._default_manager.bulk_update(
+                models, ["last_run_at", "total_run_count"], batch_size=SYNC_BATCH_SIZE
+            )
+        except DatabaseError as exc:
+            logger.exception("Database error while sync: %r", exc)
+            failed = dirty
+        except InterfaceError:
+            warning(
+                "TenantDatabaseScheduler: InterfaceError in sync(), "
+                "waiting to retry in next call..."
+            )
+            failed = dirty
+        finally:
+            # retry later, only for the failed ones
+            self._dirty |= failed
+
+    def _tenant_timezones(self):
+        public_schema_name = get_public_schema_name()
+        return {
+            tenant.timezone
+            for schema_name, tenant in tenant_cache.all().items()
+            if schema_name != public_schema_name and in_shard(tenant.pk, self.shard)
+        }
+
+
+def in_shard(tenant_pk, shard):
+    """Return whether the tenant with `tenant_pk` belongs to `shard`, if any."""
+    return shard is None or tenant_pk % shard[1] == shard[0]
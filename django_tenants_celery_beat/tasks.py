@@ -0,0 +1,143 @@
+"""Tasks that expand coordinator fan-outs on workers, see `generate_beat_schedule`."""
+from celery import group, shared_task
+from celery.utils.log import get_task_logger
+from django_tenants.utils import get_public_schema_name, schema_context
+from tenant_schemas_celery.task import TenantTask
+
+from django_tenants_celery_beat.utils import tenant_cache
+
+FAN_OUT_TASK = "django_tenants_celery_beat.tasks.fan_out"
+RUN_FOR_SCHEMAS_TASK = "django_tenants_celery_beat.tasks.run_for_schemas"
+
+logger = get_task_logger(__name__)
+
+
+class TenantBatchTask(TenantTask):
+    """Task base class for running a task for several tenants in one message.
+
+    Sent with a `_schema_names` header listing schema names, instead of a single
+    `_schema_name`, the task body is run for each of those schemas in turn, on the
+    worker's database connection, with only the connection's `search_path` changed
+    between runs. A failing run is logged and does not stop the runs for other
+    schemas. Such tasks are also run this way in `run_for_schemas` chunks of
+    coordinator fan-outs. Otherwise, it runs as any other `TenantTask`, in the schema
+    of its `_schema_name` header.
+
+    `connection.tenant` is only a stand-in with the `schema_name` during each run, so
+    use `tenant_cache.get(connection.schema_name)` or query the tenant if needed.
+    """
+
+    def __call__(self, *args, **kwargs):
+        schema_names = (self.request.headers or {}).get(
+            "_schema_names", self.request.get("_schema_names")
+        )
+        if schema_names is None:
+            return super().__call__(*args, **kwargs)
+        return self.run_batch(schema_names, args, kwargs)
+
+    def run_batch(self, schema_names, args=None, kwargs=None):
+        """Run the task body for each of `schema_names` in turn.
+
+        Returns:
+            The schema names whose runs failed.
+        """
+        failed = []
+        for schema_name in schema_names:
+            try:
+                with schema_context(schema_name):
+                    self.run(*(args or ()), **(kwargs or {}))
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.exception(
+                    "%s failed for tenant %s: %r", self.name, schema_name, exc
+                )
+                failed.append(schema_name)
+        return failed
+
+
+@shared_task(name=FAN_OUT_TASK, bind=True)
+def fan_out(
+    self,
+    task_name,
+    args=None,
+    kwargs=None,
+    chunk_size=50,
+    options=None,
+    headers=None,
+    timezone=None,
+    shard=None,
+    spread_seconds=None,
+):
+    """Send `task_name` to every tenant, `chunk_size` tenants per message.
+
+    Sent by `TenantDatabaseScheduler` in place of one message per tenant. Each chunk
+    is a `run_for_schemas` message, sent with the message `options` of the template,
+    and the chunks are sent as one group. Only tenants in `timezone` and `shard` are
+    included, if given. With `spread_seconds`, the chunks are spread evenly over that
+    many seconds.
+
+    Returns:
+        The number of tenants the task was sent to.
+    """
+    from django_tenants_celery_beat.schedulers import in_shard
+
+    public_schema_name = get_public_schema_name()
+    schema_names = [
+        schema_name
+        for schema_name, tenant in tenant_cache.all().items()
+        if schema_name != public_schema_name
+        and (timezone is None or str(tenant.timezone) == timezone)
+        and in_shard(tenant.pk, shard)
+    ]
+    chunks = [
+        schema_names[i : i + chunk_size]
+        for i in range(0, len(schema_names), chunk_size)
+    ]
+    signatures = []
+    for i, chunk in enumerate(chunks):
+        chunk_options = dict(options or {})
+        if spread_seconds:
+            chunk_options["countdown"] = spread_seconds * i // len(chunks)
+        signatures.append(
+            self.app.signature(
+                RUN_FOR_SCHEMAS_TASK,
+                (task_name, chunk, args, kwargs, headers),
+                **chunk_options,
+            )
+        )
+    if signatures:
+        group(signatures).apply_async()
+    logger.info(
+        "%s sent to %d tenants in %d chunks", task_name, len(schema_names), len(chunks)
+    )
+    return len(schema_names)
+
+
+@shared_task(name=RUN_FOR_SCHEMAS_TASK, bind=True)
+def run_for_schemas(
+    self, task_name, schema_names, args=None, kwargs=None, headers=None
+):
+    """Run `task_name` for each of `schema_names` in turn, in this worker process.
+
+    Each run is applied locally with the `_schema_name` header, so that the task runs
+    in the tenant's schema as if it had been sent there, but the connection is
+    reused. Tasks based on `TenantBatchTask` skip applying each run, and only switch
+    schemas between runs. A failing run is logged and does not stop the runs for
+    other schemas.
+
+    Returns:
+        The schema names whose runs failed.
+    """
+    task = self.app.tasks[task_name]
+    if isinstance(task, TenantBatchTask):
+        return task.run_batch(schema_names, args, kwargs)
+    failed = []
+    for schema_name in schema_names:
+        result = task.apply(
+            args, kwargs, headers={**(headers or {}), "_schema_name": schema_name}
+        )
+        if result.failed():
+            logger.error(
+                "%s failed for tenant %s: %r", task_name, schema_name, result.result
+            )
+            failed.append(schema_name)
+    return failed
@@ -1,17 +1,44 @@
-from copy import deepcopy
+import logging
+import time
+import zlib
+from collections import namedtuple
+from functools import partial
 
 from django_tenants.utils import get_tenant_model, get_public_schema_name, get_model
 from django.conf import settings
 
+logger = logging.getLogger(__name__)
+
+# Name prefix of template entries that are fanned out to all tenants at due time
+TEMPLATE_PREFIX = "all_tenants"
+
+# Tenants per message of coordinator fan-outs, see `generate_beat_schedule`
+DEFAULT_CHUNK_SIZE = 50
+
+# Entries expanded per tenant by the last `generate_beat_schedule`, by name
+_tenant_entries = {}
+
 
 def generate_beat_schedule(beat_schedule_config):
     """Generate a tenant-aware beat_schedule.
 
     Pass in a beat_schedule as normal, but each entry can have an extra key
-    `tenancy_options`, which is a dict with up to three Boolean keys:
+    `tenancy_options`, which is a dict with up to four Boolean keys:
         - `public`: run on the public schema
         - `all_tenants`: run on all tenant schemas
         - `use_tenant_timezone`: use the tenants' timezones for any crontab schedules
+        - `template`: instead of one entry per tenant, generate a single template
+          entry that `TenantDatabaseScheduler` fans out to all tenant schemas
+    and optionally `spread_seconds`, a number of seconds over which
+    `TenantDatabaseScheduler` spreads the tenants' runs of an `all_tenants` entry:
+    each tenant's run is delayed by an offset derived from its schema name, which
+    stays the same from one run to the next (see `spread_offset`).
+
+    An `all_tenants` entry with `"fanout": "coordinator"` is generated as a template,
+    but when due, `TenantDatabaseScheduler` sends a single `tasks.fan_out` message
+    instead of one message per tenant. A worker then sends the task to the tenants in
+    chunks of `chunk_size` (default 50) schemas, each chunk a single message run by
+    one worker for each schema in turn (see `tasks.run_for_schemas`).
 
     For example, if you want the entry "everywhere" to run on the public schema, and
     on all tenant schemas at midday using their local timezone:
@@ -40,6 +67,17 @@ def generate_beat_schedule(beat_schedule_config):
     The timezone would then be set on the CrontabSchedule object that is later created
     when the beat_schedule is synced with the database.
 
+    With `"template": True` as well, the tenant entries are replaced by one template:
+    ```
+    {
+        "everywhere": { "task": "some_task", "schedule": crontab(hour=12) },
+        "all_tenants: everywhere": { "task": "some_task", "schedule": crontab(hour=12) },
+    }
+    ```
+
+    The entries expanded per tenant are kept for `generate_tenant_beat_schedule`,
+    replacing those of any beat_schedule generated before.
+
     Args:
          beat_schedule_config: A valid beat_schedule dict with additional config
             describing how to handle tenancy options.
@@ -47,40 +85,439 @@ def generate_beat_schedule(beat_schedule_config):
     Returns:
         A valid beat_schedule (assign it to `app.conf.beat_schedule`).
     """
+    tenant_entries = {}
+    beat_schedule = dict(
+        iter_beat_schedule(beat_schedule_config, tenant_entries=tenant_entries)
+    )
+    _tenant_entries.clear()
+    _tenant_entries.update(tenant_entries)
+    return beat_schedule
+
+
+def iter_beat_schedule(beat_schedule_config, tenant_entries=None):
+    """Lazily generate a tenant-aware beat_schedule.
+
+    Takes the same config as `generate_beat_schedule`, but yields the beat_schedule
+    one `(name, entry)` pair at a time. The tenants are queried once, and the tenant
+    entries share everything but their `options` and `headers` dicts with the config,
+    so schedules, args and kwargs must not be modified in place.
+
+    Args:
+         beat_schedule_config: A valid beat_schedule dict with additional config
+            describing how to handle tenancy options.
+        tenant_entries: An optional dict, filled with the config of the entries
+            expanded per tenant, by name.
+
+    Yields:
+        Tuples of entry name and entry of a valid beat_schedule.
+    """
     import django
     django.setup()
 
     public_schema_name = get_public_schema_name()
-    tenants = get_tenant_model().objects.exclude(schema_name=public_schema_name)
-    beat_schedule = {}
+    schema_names = None
     for name, config in beat_schedule_config.items():
-        tenancy_options = config.pop("tenancy_options")
+        config = dict(config)
+        tenancy_options = config.pop("tenancy_options", None)
         if tenancy_options is None:
             # Missing `tenancy_options` key means the entry is ignored
             continue
         if tenancy_options.get("public", False):
-            beat_schedule[name] = _set_schema_headers(
-                deepcopy(config), public_schema_name
-            )
+            yield name, _with_schema_headers(config, public_schema_name)
         if tenancy_options.get("all_tenants", False):
-            for tenant in tenants:
-                _config = deepcopy(config)
-                use_tenant_timezone = tenancy_options.get("use_tenant_timezone", False)
-                beat_schedule[f"{tenant.schema_name}: {name}"] = _set_schema_headers(
-                    _config, tenant.schema_name, use_tenant_timezone
+            header_options = {
+                "use_tenant_timezone": tenancy_options.get("use_tenant_timezone", False),
+                "spread_seconds": tenancy_options.get("spread_seconds"),
+            }
+            if tenancy_options.get("fanout") == "coordinator":
+                yield f"{TEMPLATE_PREFIX}: {name}", _with_schema_headers(
+                    config,
+                    public_schema_name,
+                    all_tenants=True,
+                    chunk_size=tenancy_options.get("chunk_size", DEFAULT_CHUNK_SIZE),
+                    **header_options,
                 )
-    return beat_schedule
+                continue
+            if tenancy_options.get("template", False):
+                yield f"{TEMPLATE_PREFIX}: {name}", _with_schema_headers(
+                    config, public_schema_name, all_tenants=True, **header_options
+                )
+                continue
+            if tenant_entries is not None:
+                tenant_entries[name] = (config, header_options)
+            if schema_names is None:
+                schema_names = [
+                    schema_name
+                    for schema_name in tenant_cache.all()
+                    if schema_name != public_schema_name
+                ]
+            for schema_name in schema_names:
+                yield f"{schema_name}: {name}", _with_schema_headers(
+                    config, schema_name, **header_options
+                )
+
+
+def generate_tenant_beat_schedule(schema_name):
+    """Generate the beat_schedule entries for a single tenant.
+
+    Only the `all_tenants` entries (other than templates) of the last beat_schedule
+    generated by `generate_beat_schedule` in this process are included, exactly as
+    `generate_beat_schedule` would have generated them for the tenant.
+
+    Args:
+        schema_name: The schema name of the tenant.
+
+    Returns:
+        A beat_schedule dict with the tenant's entries.
+    """
+    return {
+        f"{schema_name}: {name}": _with_schema_headers(
+            config, schema_name, **header_options
+        )
+        for name, (config, header_options) in _tenant_entries.items()
+    }
+
+
+def spread_offset(schema_name, spread_seconds):
+    """Return the delay in seconds of a tenant's run within `spread_seconds`.
+
+    The offset is derived from a checksum of `schema_name`, so it is the same for
+    every run and in every process, and tenants are spread evenly over the window.
+    """
+    return zlib.crc32(schema_name.encode()) % spread_seconds
 
 
-def _set_schema_headers(config, schema_name, use_tenant_timezone=False):
+def _with_schema_headers(
+    config,
+    schema_name,
+    use_tenant_timezone=False,
+    all_tenants=False,
+    spread_seconds=None,
+    chunk_size=None,
+):
     options = config.get("options", {})
-    headers = options.get("headers", {})
-    headers["_schema_name"] = schema_name
-    headers["_use_tenant_timezone"] = use_tenant_timezone
-    options["headers"] = headers
-    config["options"] = options
-    return config
+    headers = {
+        **options.get("headers", {}),
+        "_schema_name": schema_name,
+        "_use_tenant_timezone": use_tenant_timezone,
+    }
+    if all_tenants:
+        headers["_all_tenants"] = True
+    if spread_seconds:
+        headers["_spread_seconds"] = spread_seconds
+    if chunk_size:
+        headers["_chunk_size"] = chunk_size
+    return {**config, "options": {**options, "headers": headers}}
+
+
+def sync_tenant_beat_schedule(app=None, beat_schedule=None):
+    """Sync a tenant-aware beat_schedule with the database in bulk.
+
+    This has the same result as `DatabaseScheduler` syncing each entry with
+    `update_or_create` and the `align` signal then linking each PeriodicTask to its
+    tenant, but takes a fixed number of queries however many tenants there are:
+    tenants and schedules are resolved up front, and the PeriodicTask,
+    CrontabSchedule, IntervalSchedule and PeriodicTaskTenantLink rows are written with
+    `bulk_create` and `bulk_update`, which do not send the `post_save` signal that
+    `align` is connected to. Rows that are already up to date are not written.
+
+    Args:
+        app: The Celery app whose `beat_schedule` (usually the output of
+            `generate_beat_schedule`) is synced.
+        beat_schedule: A beat_schedule to sync instead of `app.conf.beat_schedule`,
+            in which case `app` is not needed.
+
+    Returns:
+        The names of the entries that were synced.
+    """
+    from celery import schedules
+    from django.db import transaction
+    from django.utils import timezone
+    from django_celery_beat.models import (
+        CrontabSchedule,
+        IntervalSchedule,
+        PeriodicTask,
+        PeriodicTasks,
+    )
+    from kombu.utils.json import dumps
+    import pytz
+
+    from django_tenants_celery_beat.schedulers import TenantModelEntry
+
+    if beat_schedule is None:
+        beat_schedule = app.conf.beat_schedule
+    public_schema_name = get_public_schema_name()
+    link_model = get_periodic_task_tenant_link_model()
+    schedule_fields = [field for _, _, field in TenantModelEntry.model_schedules]
+
+    entries = {}
+    for name, entry in beat_schedule.items():
+        entry = dict(entry)
+        options = dict(entry.pop("options", None) or {})
+        headers = dict(options.pop("headers", None) or {})
+        headers.setdefault("_schema_name", public_schema_name)
+        # As in `PeriodicTaskTenantLinkMixin.save`, these headers are moved onto the
+        # link, and a missing header leaves the link as it is
+        link_fields = {
+            "use_tenant_timezone": headers.pop("_use_tenant_timezone", None),
+            "all_tenants": headers.pop("_all_tenants", None),
+        }
+        entries[name] = (entry, options, headers, link_fields)
+
+    with transaction.atomic():
+        tenants = tenant_cache.all()
+        if not {headers["_schema_name"] for _, _, headers, _ in entries.values()} <= set(
+            tenants
+        ):
+            # A tenant may have been created by another process
+            tenant_cache.clear()
+            tenants = tenant_cache.all()
+        periodic_tasks = {
+            periodic_task.name: periodic_task
+            for periodic_task in PeriodicTask.objects.filter(
+                name__in=entries
+            ).select_related("periodic_task_tenant_link")
+        }
+        crontabs = {
+            _crontab_key(crontab): crontab for crontab in CrontabSchedule.objects.all()
+        }
+        intervals = {
+            (interval.every, interval.period): interval
+            for interval in IntervalSchedule.objects.all()
+        }
+
+        synced = {}
+        for name, (entry, options, headers, link_fields) in entries.items():
+            try:
+                tenant_id, _, tenant_tz, _ = tenants[headers["_schema_name"]]
+            except KeyError:
+                logger.error(
+                    "Cannot sync entry %r: no tenant with schema %r",
+                    name,
+                    headers["_schema_name"],
+                )
+                continue
+            periodic_task = periodic_tasks.get(name)
+            link = getattr(periodic_task, "periodic_task_tenant_link", None)
+            for field, value in link_fields.items():
+                if value is None:
+                    link_fields[field] = getattr(link, field, False)
+            link_fields["tenant_id"] = tenant_id
+            link_fields["schema_name"] = headers["_schema_name"]
+            link_fields["tenant_timezone"] = tenant_tz
+
+            schedule = schedules.maybe_schedule(entry.pop("schedule"))
+            if isinstance(schedule, schedules.crontab):
+                tz = tenant_tz if link_fields["use_tenant_timezone"] else pytz.utc
+                crontab = _crontab_from_schedule(schedule, tz)
+                model_schedule = crontabs.setdefault(_crontab_key(crontab), crontab)
+                model_field = "crontab"
+            elif type(schedule) is schedules.schedule:
+                every = max(schedule.run_every.total_seconds(), 0)
+                model_schedule = intervals.setdefault(
+                    (every, IntervalSchedule.SECONDS),
+                    IntervalSchedule(every=every, period=IntervalSchedule.SECONDS),
+                )
+                model_field = "interval"
+            else:
+                model_schedule, model_field = TenantModelEntry.to_model_schedule(
+                    schedule
+                )
+
+            args = entry.pop("args", None)
+            kwargs = entry.pop("kwargs", None)
+            entry.pop("relative", None)
+            fields = {
+                **entry,
+                **{field: None for field in schedule_fields},
+                model_field: model_schedule,
+                "args": dumps(args or []),
+                "kwargs": dumps(kwargs or {}),
+                **TenantModelEntry._unpack_options(**options, headers=headers),
+            }
+            synced[name] = (fields, link_fields)
+
+        # Create any new schedules first, so that their ids can be used
+        CrontabSchedule.objects.bulk_create(
+            [crontab for crontab in crontabs.values() if crontab.pk is None]
+        )
+        IntervalSchedule.objects.bulk_create(
+            [interval for interval in intervals.values() if interval.pk is None]
+        )
+
+        now = timezone.now()
+        new_tasks, changed_tasks, changed_fields = [], [], set()
+        for name, (fields, _) in synced.items():
+            # Compare foreign keys by id, so that no related objects are fetched
+            for field in schedule_fields:
+                model_schedule = fields.pop(field)
+                fields[f"{field}_id"] = model_schedule and model_schedule.pk
+            periodic_task = periodic_tasks.get(name)
+            if periodic_task is None:
+                periodic_tasks[name] = PeriodicTask(name=name, **fields)
+                new_tasks.append(periodic_tasks[name])
+                continue
+            changed = {
+                field
+                for field, value in fields.items()
+                if getattr(periodic_task, field) != value
+            }
+            if changed:
+                for field in changed:
+                    setattr(periodic_task, field, fields[field])
+                periodic_task.date_changed = now
+                changed_tasks.append(periodic_task)
+                changed_fields |= changed | {"date_changed"}
+        PeriodicTask.objects.bulk_create(new_tasks)
+        new_task_ids = {periodic_task.pk for periodic_task in new_tasks}
+        if changed_tasks:
+            PeriodicTask.objects.bulk_update(changed_tasks, changed_fields)
+        changed_task_ids = {periodic_task.pk for periodic_task in changed_tasks}
+
+        new_links, changed_links, changed_link_fields = [], [], set()
+        for name, (_, link_fields) in synced.items():
+            periodic_task = periodic_tasks[name]
+            link = None
+            if periodic_task.pk not in new_task_ids:
+                link = getattr(periodic_task, "periodic_task_tenant_link", None)
+            if link is None:
+                new_links.append(link_model(periodic_task=periodic_task, **link_fields))
+                continue
+            if periodic_task.pk in changed_task_ids:
+                # As in `align`, the task may be due at another time
+                link_fields["next_run_at"] = None
+            changed = {
+                field
+                for field, value in link_fields.items()
+                if getattr(link, field) != value
+            }
+            if changed:
+                for field in changed:
+                    setattr(link, field, link_fields[field])
+                changed_links.append(link)
+                changed_link_fields |= changed
+        link_model.objects.bulk_create(new_links)
+        if changed_links:
+            link_model.objects.bulk_update(changed_links, changed_link_fields)
+
+        if new_tasks or changed_tasks or new_links or changed_links:
+            PeriodicTasks.update_changed()
+    return list(synced)
+
+
+def _crontab_from_schedule(schedule, tz):
+    from django_celery_beat.models import CrontabSchedule
+
+    return CrontabSchedule(
+        minute=str(schedule._orig_minute),
+        hour=str(schedule._orig_hour),
+        day_of_week=str(schedule._orig_day_of_week),
+        day_of_month=str(schedule._orig_day_of_month),
+        month_of_year=str(schedule._orig_month_of_year),
+        timezone=tz,
+    )
+
+
+def _crontab_key(crontab):
+    return (
+        crontab.minute,
+        crontab.hour,
+        crontab.day_of_week,
+        crontab.day_of_month,
+        crontab.month_of_year,
+        str(crontab.timezone),
+    )
 
 
 def get_periodic_task_tenant_link_model():
     return get_model(settings.PERIODIC_TASK_TENANT_LINK_MODEL)
+
+
+TenantInfo = namedtuple("TenantInfo", ["pk", "schema_name", "timezone", "name"])
+
+
+class TenantCache:
+    """Cache of the metadata of all tenants, as `TenantInfo`s.
+
+    All tenants are loaded with a single query and kept for
+    `TENANT_BEAT_TENANT_CACHE_TIMEOUT` seconds (default 60). The cache is cleared
+    whenever any tenant is saved or deleted, but only in the process that does so: if
+    the `TENANT_BEAT_TENANT_CACHE` setting names one of the `CACHES`, the tenants are
+    kept there instead, so that all processes see the changes, and each process only
+    keeps its own copy for `TENANT_BEAT_TENANT_CACHE_LOCAL_TIMEOUT` seconds (default 1),
+    rather than fetching every tenant from the backend for each lookup.
+    """
+
+    cache_key = "django_tenants_celery_beat:tenants"
+
+    def __init__(self):
+        self._tenants = None
+        self._expires = 0
+        self._by_pk = None
+
+    @property
+    def timeout(self):
+        return getattr(settings, "TENANT_BEAT_TENANT_CACHE_TIMEOUT", 60)
+
+    @property
+    def local_timeout(self):
+        return getattr(settings, "TENANT_BEAT_TENANT_CACHE_LOCAL_TIMEOUT", 1)
+
+    @property
+    def backend(self):
+        alias = getattr(settings, "TENANT_BEAT_TENANT_CACHE", None)
+        if alias is None:
+            return None
+        from django.core.cache import caches
+
+        return caches[alias]
+
+    def all(self):
+        """Return a dict of all tenants' `TenantInfo`s, by schema name."""
+        if self._tenants is None or time.monotonic() >= self._expires:
+            backend = self.backend
+            if backend is not None:
+                self._tenants = backend.get_or_set(
+                    self.cache_key, self._load, self.timeout
+                )
+                self._expires = time.monotonic() + self.local_timeout
+            else:
+                self._tenants = self._load()
+                self._expires = time.monotonic() + self.timeout
+        return self._tenants
+
+    def get(self, schema_name):
+        """Return the `TenantInfo` of the tenant with `schema_name`, or None."""
+        return self.all().get(schema_name)
+
+    def get_by_pk(self, pk):
+        """Return the `TenantInfo` of the tenant with primary key `pk`, or None."""
+        tenants = self.all()
+        if self._by_pk is None or self._by_pk[0] is not tenants:
+            self._by_pk = (tenants, {tenant.pk: tenant for tenant in tenants.values()})
+        return self._by_pk[1].get(pk)
+
+    def clear(self, **kwargs):
+        self._tenants = None
+        self._by_pk = None
+        backend = self.backend
+        if backend is not None:
+            from django.db import transaction
+
+            backend.delete(self.cache_key)
+            # Other processes may reload the tenants before the change is committed
+            transaction.on_commit(partial(backend.delete, self.cache_key))
+
+    @staticmethod
+    def _load():
+        tenant_model = get_tenant_model()
+        fields = ["pk", "schema_name", "timezone"]
+        if any(field.name == "name" for field in tenant_model._meta.get_fields()):
+            fields.append("name")
+        return {
+            values[1]: TenantInfo(*values, *[None] * (4 - len(values)))
+            for values in tenant_model.objects.values_list(*fields)
+        }
+
+
+tenant_cache = TenantCache()
@@ -0,0 +1,115 @@
+"""Benchmarks for the hot paths of django-tenants-celery-beat.
+
+Run a benchmark module from the `example` directory, e.g.:
+```
+python -m benchmarks.generate_beat_schedule --tenants 100 1000 10000
+```
+or all of them with `python -m benchmarks`, which takes the same arguments.
+Each run creates (and afterwards destroys) a test database, in the same way as
+`python manage.py test`, using `example.settings` unless `DJANGO_SETTINGS_MODULE` says
+otherwise.
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import django
+
+
+@contextmanager
+def benchmark_database():
+    """Set up Django and a fresh test database for the duration of the block."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "example.settings")
+    django.setup()
+
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    runner = DiscoverRunner(interactive=False, verbosity=0)
+    setup_test_environment()
+    old_config = runner.setup_databases()
+    try:
+        yield
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+
+def create_tenants(count):
+    """Replace all tenants with the public tenant and `count` tenants.
+
+    Tenants are spread over a handful of timezones. Their schemas are not created.
+    """
+    from tenancy.models import Tenant
+
+    timezones = ["UTC", "Europe/London", "US/Eastern", "Asia/Tokyo", "Australia/Sydney"]
+    Tenant.objects.all().delete()
+    return Tenant.objects.bulk_create(
+        [Tenant(name="Public", schema_name="public")]
+        + [
+            Tenant(
+                name=f"Tenant {i}",
+                schema_name=f"tenant{i}",
+                timezone=timezones[i % len(timezones)],
+            )
+            for i in range(count)
+        ]
+    )
+
+
+def measure(func, *args, **kwargs):
+    """Call `func`, returning its result and a `(seconds, queries, peak bytes)` row.
+
+    Queries are those run on the default database, including django-tenants'
+    `SET search_path` statements. Memory is the peak size of blocks allocated by Python
+    during the call, as traced by `tracemalloc`.
+    """
+    from django.db import connection
+
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(count_queries):
+            result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, (elapsed, queries, peak)
+
+
+def report(title, rows):
+    """Print a table of `(label, (seconds, queries, peak bytes))` rows."""
+    print(title)
+    print(f"{'':>32} {'time (s)':>10} {'queries':>9} {'peak (MiB)':>11}")
+    for label, (elapsed, queries, peak) in rows:
+        print(f"{label:>32} {elapsed:>10.3f} {queries:>9} {peak / 2 ** 20:>11.1f}")
+    print()
+
+
+def parser(description, entries=20):
+    """Return an argument parser with the options shared by all the benchmarks."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--tenants",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10000],
+        help="numbers of tenants to benchmark with",
+    )
+    parser.add_argument(
+        "--entries",
+        type=int,
+        default=entries,
+        help="number of beat_schedule entries per tenant",
+    )
+    return parser
@@ -0,0 +1,7 @@
+"""Run all the benchmarks with the same arguments."""
+import sys
+
+from benchmarks import align, generate_beat_schedule, scheduler_tick
+
+for benchmark in (generate_beat_schedule, align, scheduler_tick):
+    benchmark.main(sys.argv[1:])
@@ -0,0 +1,80 @@
+"""Benchmark saving tenant `PeriodicTask`s, which are aligned with their tenant links.
+
+Each save of a `PeriodicTask` runs the `align` signal receiver and, if the task is new
+or its tenancy headers changed, `PeriodicTaskTenantLinkMixin.save`. This is the path
+taken by `DatabaseScheduler` when it syncs the `beat_schedule` without bulk syncing, and
+by any save of only a run's `last_run_at` and `total_run_count`.
+"""
+from benchmarks import benchmark_database, create_tenants, measure, parser, report
+
+
+def create_tasks(tenants, entries):
+    import json
+
+    from django_celery_beat.models import CrontabSchedule, PeriodicTask
+
+    crontabs = [CrontabSchedule.objects.create(minute=i % 60) for i in range(entries)]
+    return [
+        PeriodicTask.objects.create(
+            name=f"{tenant.schema_name}: task{i}",
+            task=f"core.tasks.task{i}",
+            crontab=crontab,
+            headers=json.dumps(
+                {"_schema_name": tenant.schema_name, "_use_tenant_timezone": True}
+            ),
+        )
+        for tenant in tenants
+        for i, crontab in enumerate(crontabs)
+    ]
+
+
+def record_runs(periodic_tasks):
+    """Record a run of each task with a save of only the run fields, one by one.
+
+    `align` skips such saves. `TenantDatabaseScheduler` itself no longer saves runs
+    one by one: `reserve` keeps them in the schedule and `sync` writes them back with
+    `bulk_update`, which sends no signals.
+    """
+    from django.utils import timezone
+    from django_celery_beat.models import PeriodicTask
+
+    for periodic_task in periodic_tasks:
+        obj = PeriodicTask.objects.get(pk=periodic_task.pk)
+        obj.last_run_at = timezone.now()
+        obj.total_run_count += 1
+        obj.no_changes = True
+        obj.save(update_fields=["last_run_at", "total_run_count"])
+
+
+def change_tasks(periodic_tasks):
+    from django_celery_beat.models import PeriodicTask
+
+    for periodic_task in periodic_tasks:
+        obj = PeriodicTask.objects.get(pk=periodic_task.pk)
+        obj.description = "changed"
+        obj.save()
+
+
+def main(argv=None):
+    args = parser(__doc__, entries=1).parse_args(argv)
+
+    with benchmark_database():
+        from django_celery_beat.models import PeriodicTask
+
+        rows = []
+        for tenants in args.tenants:
+            PeriodicTask.objects.all().delete()
+            tenant_objs = create_tenants(tenants)[1:]
+            periodic_tasks, row = measure(create_tasks, tenant_objs, args.entries)
+            rows.append((f"{tenants} tenants (create)", row))
+            _, row = measure(record_runs, periodic_tasks)
+            rows.append((f"{tenants} tenants (record run)", row))
+            _, row = measure(change_tasks, periodic_tasks)
+            rows.append((f"{tenants} tenants (change)", row))
+        report(
+            f"PeriodicTask.save and align, {args.entries} entries per tenant", rows
+        )
+
+
+if __name__ == "__main__":
+    main()
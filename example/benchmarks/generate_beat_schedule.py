@@ -0,0 +1,51 @@
+"""Benchmark `generate_beat_schedule` against the number of tenants and entries."""
+from benchmarks import benchmark_database, create_tenants, measure, parser, report
+
+
+def beat_schedule_config(entries, **tenancy_options):
+    """Return a beat_schedule config of `entries` entries run on all tenants."""
+    from celery.schedules import crontab
+
+    return {
+        f"task{i}": {
+            "task": f"core.tasks.task{i}",
+            "schedule": crontab(minute=i % 60, hour=i % 24),
+            "options": {"expire_seconds": 3600, "headers": {"extra": "header"}},
+            "tenancy_options": {
+                "public": i % 2 == 0,
+                "all_tenants": True,
+                "use_tenant_timezone": True,
+                **tenancy_options,
+            },
+        }
+        for i in range(entries)
+    }
+
+
+def main(argv=None):
+    args = parser(__doc__).parse_args(argv)
+
+    with benchmark_database():
+        from django_tenants_celery_beat.utils import (
+            generate_beat_schedule,
+            iter_beat_schedule,
+        )
+
+        rows = []
+        for tenants in args.tenants:
+            create_tenants(tenants)
+            config = beat_schedule_config(args.entries)
+            beat_schedule, row = measure(generate_beat_schedule, config)
+            rows.append((f"{tenants} tenants", row))
+            # Streaming the entries only holds one entry at a time
+            _, row = measure(lambda: sum(1 for _ in iter_beat_schedule(config)))
+            rows.append((f"{tenants} tenants (iter)", row))
+        report(
+            f"generate_beat_schedule, {args.entries} entries "
+            f"({len(beat_schedule)} generated for {args.tenants[-1]} tenants)",
+            rows,
+        )
+
+
+if __name__ == "__main__":
+    main()
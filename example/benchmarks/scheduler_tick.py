@@ -0,0 +1,69 @@
+"""Benchmark `TenantDatabaseScheduler` loading its schedule and sending what is due.
+
+The `beat_schedule` is synced with every entry already due, then the schedule is loaded,
+a single tick sends every due entry to an in-memory broker and the runs are written
+back to the database, then a second tick finds nothing due. This is run with one
+`PeriodicTask` per tenant and entry, with those tasks bucketed by timezone (the
+`TENANT_BEAT_BUCKET_BY_TIMEZONE` setting), fetched by their next run time (the
+`TENANT_BEAT_DUE_QUERY` setting), and with template entries.
+"""
+from benchmarks import benchmark_database, create_tenants, measure, parser, report
+from benchmarks.generate_beat_schedule import beat_schedule_config
+
+MODES = {
+    "per tenant": ({}, {}),
+    "bucketed": ({}, {"TENANT_BEAT_BUCKET_BY_TIMEZONE": True}),
+    "due query": ({}, {"TENANT_BEAT_DUE_QUERY": True}),
+    "template": ({"template": True}, {}),
+}
+
+
+def scheduler_rows(label, entries, tenancy_options, settings):
+    from celery import Celery
+    from django.test import override_settings
+    from django_celery_beat.models import PeriodicTask
+    from django_tenants_celery_beat.schedulers import TenantDatabaseScheduler
+    from django_tenants_celery_beat.utils import (
+        generate_beat_schedule,
+        sync_tenant_beat_schedule,
+    )
+
+    PeriodicTask.objects.all().delete()
+    app = Celery(set_as_current=False, broker="memory://")
+    app.conf.beat_schedule = generate_beat_schedule(
+        beat_schedule_config(entries, **tenancy_options)
+    )
+    sync_tenant_beat_schedule(app)
+    PeriodicTask.objects.update(last_run_at="2000-01-01T00:00:00Z")
+
+    with override_settings(TENANT_BEAT_FANOUT_CHUNK_SIZE=10 ** 9, **settings):
+        scheduler = TenantDatabaseScheduler(app=app, lazy=True)
+        _, load_row = measure(lambda: scheduler.schedule)
+        _, tick_row = measure(scheduler.tick)
+        _, sync_row = measure(scheduler.sync)
+        _, idle_row = measure(scheduler.tick)
+        scheduler.close()
+    return [
+        (f"{label} (load)", load_row),
+        (f"{label} (tick)", tick_row),
+        (f"{label} (sync)", sync_row),
+        (f"{label} (idle tick)", idle_row),
+    ]
+
+
+def main(argv=None):
+    args = parser(__doc__, entries=5).parse_args(argv)
+
+    with benchmark_database():
+        rows = []
+        for tenants in args.tenants:
+            create_tenants(tenants)
+            for mode, (tenancy_options, settings) in MODES.items():
+                rows += scheduler_rows(
+                    f"{tenants} tenants, {mode}", args.entries, tenancy_options, settings
+                )
+        report(f"TenantDatabaseScheduler, {args.entries} entries", rows)
+
+
+if __name__ == "__main__":
+    main()
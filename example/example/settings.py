@@ -181,7 +181,7 @@ CELERY_BROKER_TRANSPORT_OPTIONS = {
 }
 
 CELERY_RESULT_BACKEND = "django-db"
-CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+CELERY_BEAT_SCHEDULER = "django_tenants_celery_beat.schedulers:TenantDatabaseScheduler"
 
 os.makedirs(CELERY_BROKER_TRANSPORT_OPTIONS["data_folder_out"], exist_ok=True)
 os.makedirs(CELERY_BROKER_TRANSPORT_OPTIONS["data_folder_processed"], exist_ok=True)
@@ -8,3 +8,4 @@ from tenancy.models import Tenant
 @admin.register(Tenant)
 class ClientAdmin(TenantAdminMixin, admin.ModelAdmin):
     list_display = ("name",)
+    search_fields = ("name", "schema_name")
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-17 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenancy', '0002_periodictasktenantlink'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='periodictasktenantlink',
+            name='all_tenants',
+            field=models.BooleanField(default=False),
+        ),
+    ]
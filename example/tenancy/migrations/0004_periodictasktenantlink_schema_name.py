@@ -0,0 +1,43 @@
+# Generated by Django 3.2.13 on 2026-10-17 13:05
+
+from django.db import migrations, models
+
+
+def populate_schema_names(apps, schema_editor):
+    PeriodicTaskTenantLink = apps.get_model("tenancy", "PeriodicTaskTenantLink")
+    Tenant = apps.get_model("tenancy", "Tenant")
+    PeriodicTaskTenantLink.objects.update(
+        schema_name=models.Subquery(
+            Tenant.objects.filter(pk=models.OuterRef("tenant_id")).values(
+                "schema_name"
+            )[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenancy', '0003_periodictasktenantlink_all_tenants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='periodictasktenantlink',
+            name='schema_name',
+            field=models.CharField(blank=True, editable=False, max_length=63),
+        ),
+        migrations.RunPython(populate_schema_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='periodictasktenantlink',
+            index=models.Index(fields=['tenant', 'use_tenant_timezone'], name='dtcb_link_tenant_tz_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='periodictasktenantlink',
+            index=models.Index(fields=['tenant', 'periodic_task'], name='dtcb_link_tenant_task_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='periodictasktenantlink',
+            index=models.Index(fields=['schema_name', 'periodic_task'], name='dtcb_link_schema_task_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.13 on 2026-10-17 13:06
+
+from django.db import migrations, models
+import timezone_field.fields
+
+
+def populate_tenant_timezones(apps, schema_editor):
+    PeriodicTaskTenantLink = apps.get_model("tenancy", "PeriodicTaskTenantLink")
+    Tenant = apps.get_model("tenancy", "Tenant")
+    PeriodicTaskTenantLink.objects.update(
+        tenant_timezone=models.Subquery(
+            Tenant.objects.filter(pk=models.OuterRef("tenant_id")).values(
+                "timezone"
+            )[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenancy', '0004_periodictasktenantlink_schema_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='periodictasktenantlink',
+            name='tenant_timezone',
+            field=timezone_field.fields.TimeZoneField(default='UTC', editable=False),
+        ),
+        migrations.RunPython(populate_tenant_timezones, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.13 on 2026-10-17 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenancy', '0005_periodictasktenantlink_tenant_timezone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='periodictasktenantlink',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='periodictasktenantlink',
+            index=models.Index(fields=['next_run_at'], name='dtcb_link_next_run_idx'),
+        ),
+    ]
@@ -23,4 +23,5 @@ class Domain(DomainMixin):
 
 
 class PeriodicTaskTenantLink(PeriodicTaskTenantLinkMixin):
-    pass
+    class Meta(PeriodicTaskTenantLinkMixin.IndexedMeta):
+        pass
@@ -0,0 +1,117 @@
+import json
+from unittest.mock import patch
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_celery_beat.models import IntervalSchedule, PeriodicTask
+from django_tenants_celery_beat.admin import (
+    CachedTaskListFilter,
+    EstimatedCountPaginator,
+    ScalableTenantPeriodicTaskAdmin,
+)
+from django_tenants_celery_beat.utils import tenant_cache
+from tenancy.models import Tenant
+
+
+class ScalableTenantPeriodicTaskAdminTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tenants = Tenant.objects.bulk_create(
+            [
+                Tenant(name="Public", schema_name="public"),
+                Tenant(name="Tenant 1", schema_name="tenant1"),
+                Tenant(name="Tenant 2", schema_name="tenant2"),
+            ]
+        )
+        interval = IntervalSchedule.objects.create(
+            every=1, period=IntervalSchedule.DAYS
+        )
+        for tenant in cls.tenants[1:]:
+            for task in ["task_a", "task_b"]:
+                PeriodicTask.objects.create(
+                    name=f"{tenant.schema_name}: {task}",
+                    task=task,
+                    interval=interval,
+                    headers=json.dumps({"_schema_name": tenant.schema_name}),
+                )
+        cls.user = User.objects.create_superuser("admin", "admin@example.com", "pw")
+
+    def setUp(self):
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+        for tenant in self.tenants:
+            cache_key = f"{CachedTaskListFilter.cache_key}:{tenant.schema_name}"
+            cache.delete(cache_key)
+            self.addCleanup(cache.delete, cache_key)
+        self.model_admin = ScalableTenantPeriodicTaskAdmin(PeriodicTask, admin.site)
+
+    def get(self, request_tenant, **params):
+        request = RequestFactory().get("/admin/django_celery_beat/periodictask/", params)
+        request.user = self.user
+        request.tenant = request_tenant
+        response = self.model_admin.changelist_view(request)
+        response.render()
+        return response
+
+    def test_changelist(self):
+        """Filter by tenant and task, in name order, without listing every tenant."""
+        response = self.get(
+            self.tenants[0],
+            tenant=self.tenants[1].pk,
+        )
+        self.assertEqual(
+            [obj.name for obj in response.context_data["cl"].result_list],
+            ["tenant1: task_a", "tenant1: task_b"],
+        )
+        self.assertContains(response, "admin-autocomplete")
+        self.assertNotContains(response, "Tenant 2")
+
+        response = self.get(self.tenants[0], task="task_b")
+        self.assertEqual(
+            [obj.name for obj in response.context_data["cl"].result_list],
+            ["tenant1: task_b", "tenant2: task_b"],
+        )
+
+    def test_task_names_cached(self):
+        """Distinct task names and start dates are not queried on every page load."""
+        self.get(self.tenants[1])
+        with CaptureQueriesContext(connection) as queries:
+            self.get(self.tenants[1])
+        self.assertFalse(
+            any("DISTINCT" in query["sql"] for query in queries),
+            "Task names are cached",
+        )
+
+    def test_task_names_per_tenant(self):
+        """Tenant-level admins only list their own tenant's task names."""
+        PeriodicTask.objects.create(
+            name="tenant2: task_c",
+            task="task_c",
+            interval=IntervalSchedule.objects.first(),
+            headers=json.dumps({"_schema_name": "tenant2"}),
+        )
+        self.assertNotContains(self.get(self.tenants[1]), "task_c")
+        self.assertContains(self.get(self.tenants[2]), "task_c")
+        self.assertContains(self.get(self.tenants[0]), "task_c")
+
+    def test_estimated_count(self):
+        """Large result sets are counted with the planner's estimate."""
+        queryset = PeriodicTask.objects.order_by("name")
+        self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 4)
+        with patch.object(EstimatedCountPaginator, "exact_count_threshold", 0):
+            paginator = EstimatedCountPaginator(queryset, 100)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertIsInstance(paginator.count, int)
+            self.assertFalse(
+                any("COUNT(" in query["sql"] for query in queries),
+                "Rows are not counted",
+            )
+        self.assertEqual(
+            EstimatedCountPaginator(queryset.filter(pk__in=[]), 100).count, 0
+        )
@@ -0,0 +1,132 @@
+import json
+from io import StringIO
+
+import pytz
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+from django_celery_beat.models import (
+    CrontabSchedule,
+    IntervalSchedule,
+    PeriodicTask,
+    PeriodicTasks,
+)
+from django_tenants_celery_beat.utils import (
+    get_periodic_task_tenant_link_model,
+    tenant_cache,
+)
+from tenancy.models import Tenant
+
+
+class TenantBeatCommandTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tenants = Tenant.objects.bulk_create(
+            [
+                Tenant(name="Public", schema_name="public"),
+                Tenant(name="Customer 1", schema_name="customer1", timezone="UTC"),
+                Tenant(
+                    name="Customer 2", schema_name="customer2", timezone="US/Eastern"
+                ),
+                Tenant(name="Other", schema_name="other", timezone="Asia/Tokyo"),
+            ]
+        )
+
+    def setUp(self):
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+        interval = IntervalSchedule.objects.create(
+            every=1, period=IntervalSchedule.DAYS
+        )
+        for tenant in self.tenants[1:]:
+            for task in ["task_a", "task_b"]:
+                PeriodicTask.objects.create(
+                    name=f"{tenant.schema_name}: {task}",
+                    task=task,
+                    interval=interval,
+                    headers=json.dumps(
+                        {
+                            "_schema_name": tenant.schema_name,
+                            "_use_tenant_timezone": task == "task_a",
+                        }
+                    ),
+                )
+
+    def call(self, *args):
+        stdout = StringIO()
+        call_command("tenant_beat", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_disable_enable(self):
+        """Matching tasks are updated in bulk, and beat is told once."""
+        last_change = PeriodicTasks.last_change()
+
+        # One UPDATE of the tasks and update_changed, in a savepoint
+        with self.assertNumQueries(10):
+            output = self.call(
+                "disable", "--schema-pattern", "customer*", "--task", "task_b"
+            )
+
+        self.assertIn("2 periodic tasks disabled", output)
+        self.assertEqual(
+            set(
+                PeriodicTask.objects.filter(enabled=False).values_list(
+                    "name", flat=True
+                )
+            ),
+            {"customer1: task_b", "customer2: task_b"},
+        )
+        self.assertGreater(PeriodicTasks.last_change(), last_change)
+
+        output = self.call("enable", "--tenant", "customer1", "--tenant", "customer2")
+        self.assertIn("2 periodic tasks enabled", output)
+        self.assertFalse(PeriodicTask.objects.filter(enabled=False).exists())
+
+    def test_reschedule(self):
+        """Tasks get the new crontab, in their tenant's timezone if they use it."""
+        output = self.call("reschedule", "--all", "--crontab", "0 4 * * *")
+
+        self.assertIn("6 periodic tasks rescheduled", output)
+        for periodic_task in PeriodicTask.objects.select_related("crontab"):
+            self.assertIsNone(periodic_task.interval_id)
+            self.assertEqual(periodic_task.crontab.hour, "4")
+            tenant = Tenant.objects.get(
+                schema_name=periodic_task.name.split(":")[0]
+            )
+            self.assertEqual(
+                periodic_task.crontab.timezone,
+                pytz.timezone(str(tenant.timezone))
+                if periodic_task.task == "task_a"
+                else pytz.utc,
+            )
+        self.assertEqual(CrontabSchedule.objects.count(), 3)
+
+    def test_reschedule_dry_run(self):
+        """A dry run counts the tasks that would be rescheduled, not all matches."""
+        unlinked = PeriodicTask.objects.create(
+            name="unlinked",
+            task="task_a",
+            interval=IntervalSchedule.objects.first(),
+        )
+        get_periodic_task_tenant_link_model().objects.filter(
+            periodic_task=unlinked
+        ).delete()
+
+        self.assertIn(
+            "6 periodic tasks would be rescheduled",
+            self.call("reschedule", "--all", "--crontab", "0 4 * * *", "--dry-run"),
+        )
+        self.assertIn(
+            "6 periodic tasks rescheduled",
+            self.call("reschedule", "--all", "--crontab", "0 4 * * *"),
+        )
+
+    def test_no_filters(self):
+        with self.assertRaises(CommandError):
+            self.call("disable")
+        self.assertIn(
+            "6 periodic tasks would be disabled",
+            self.call("disable", "--all", "--dry-run"),
+        )
+        self.assertFalse(PeriodicTask.objects.filter(enabled=False).exists())
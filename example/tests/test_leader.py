@@ -0,0 +1,48 @@
+from django.test import TestCase
+
+from django_tenants_celery_beat.leader import AdvisoryLeaderLock, TableLeaderLock
+from django_tenants_celery_beat.models import BeatLeaderLock
+
+
+class AdvisoryLeaderLockTestCase(TestCase):
+    def test_acquire(self):
+        """The lock is held by one process at a time, until released."""
+        lock, other = AdvisoryLeaderLock("test"), AdvisoryLeaderLock("test")
+        self.addCleanup(lock.release)
+        self.addCleanup(other.release)
+
+        self.assertTrue(lock.acquire())
+        self.assertTrue(lock.acquire(), "Held lock is kept")
+        self.assertFalse(other.acquire())
+
+        lock.release()
+        self.assertTrue(other.acquire())
+
+    def test_connection_lost(self):
+        """The lock is released along with its connection."""
+        lock, other = AdvisoryLeaderLock("test"), AdvisoryLeaderLock("test")
+        self.addCleanup(lock.release)
+        self.addCleanup(other.release)
+        self.assertTrue(lock.acquire())
+
+        lock.connection.close()
+        self.assertFalse(lock.acquire())
+        self.assertTrue(other.acquire())
+
+
+class TableLeaderLockTestCase(TestCase):
+    def test_acquire(self):
+        """The lock is held by one process at a time, until it expires."""
+        lock, other = TableLeaderLock("test"), TableLeaderLock("test")
+
+        self.assertTrue(lock.acquire())
+        self.assertTrue(lock.acquire(), "Held lock is renewed")
+        self.assertFalse(other.acquire())
+
+        BeatLeaderLock.objects.update(expires_at="2000-01-01T00:00Z")
+        self.assertTrue(other.acquire())
+        self.assertFalse(lock.acquire())
+
+        other.release()
+        self.assertFalse(BeatLeaderLock.objects.exists())
+        self.assertTrue(lock.acquire())
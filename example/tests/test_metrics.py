@@ -0,0 +1,190 @@
+import json
+import os
+import socket
+import tempfile
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from celery import Celery
+from celery.beat import event_t
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from django_celery_beat.models import CrontabSchedule, IntervalSchedule, PeriodicTask
+from django_tenants_celery_beat import metrics
+from django_tenants_celery_beat.schedulers import TenantDatabaseScheduler
+from django_tenants_celery_beat.utils import tenant_cache
+from tenancy.models import Tenant
+
+
+MEMORY_SINK = "django_tenants_celery_beat.metrics.MemorySink"
+
+
+class SinkTestCase(SimpleTestCase):
+    def test_histogram(self):
+        """Values are counted in the first bucket they fit in, cumulatively."""
+        histogram = metrics.Histogram(buckets=(1, 10))
+        for value in [0.5, 1, 2, 20]:
+            histogram.observe(value)
+
+        self.assertEqual(
+            list(histogram.cumulative_counts()), [(1, 2), (10, 3), (float("inf"), 4)]
+        )
+        self.assertEqual(histogram.sum, 23.5)
+
+    def test_statsd(self):
+        """Each value is sent as a timing in milliseconds."""
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+
+        sink = metrics.StatsdSink(port=server.getsockname()[1], host="127.0.0.1")
+        sink.record("queue_wait", 0.25, "tenant1", "app.tasks.task")
+        self.assertEqual(
+            server.recv(1024),
+            b"tenant_beat.queue_wait.tenant1.app_tasks_task:250.000|ms",
+        )
+
+        sink.tags = True
+        sink.record("queue_wait", 0.25, "tenant1", "app.tasks.task")
+        self.assertEqual(
+            server.recv(1024),
+            b"tenant_beat.queue_wait:250.000|ms|#tenant:tenant1,task:app.tasks.task",
+        )
+
+    def test_prometheus_textfile(self):
+        """Histograms are written to the file in the Prometheus text format."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "tenant_beat_{pid}.prom")
+            sink = metrics.PrometheusTextfileSink(path, buckets=(1,))
+            sink.record("run_duration", 0.5, "tenant1", "app.tasks.task")
+
+            with open(path.format(pid=os.getpid())) as f:
+                text = f.read()
+
+        labels = 'tenant="tenant1",task="app.tasks.task"'
+        self.assertIn("# TYPE tenant_beat_run_duration_seconds histogram", text)
+        self.assertIn(
+            f'tenant_beat_run_duration_seconds_bucket{{{labels},le="1.0"}} 1', text
+        )
+        self.assertIn(
+            f'tenant_beat_run_duration_seconds_bucket{{{labels},le="+Inf"}} 1', text
+        )
+        self.assertIn(f"tenant_beat_run_duration_seconds_count{{{labels}}} 1", text)
+
+
+@override_settings(TENANT_BEAT_METRICS_SINK=MEMORY_SINK)
+class MetricsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Tenant.objects.bulk_create(
+            [
+                Tenant(name="Public", schema_name="public"),
+                Tenant(name="Tenant 1", schema_name="tenant1"),
+                Tenant(name="Tenant 2", schema_name="tenant2"),
+            ]
+        )
+
+    def setUp(self):
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+        patcher = patch.object(metrics, "_sink", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = Celery(set_as_current=False)
+
+    def test_stamp_headers(self):
+        """Messages sent by beat, including fan-outs, carry the beat timestamps."""
+        PeriodicTask.objects.create(
+            name="all_tenants: task",
+            task="test_task",
+            crontab=CrontabSchedule.objects.create(hour="12"),
+            headers=json.dumps({"_schema_name": "public", "_all_tenants": True}),
+        )
+        PeriodicTask.objects.create(
+            name="tenant1: task",
+            task="test_task",
+            crontab=CrontabSchedule.objects.create(hour="12"),
+            headers=json.dumps({"_schema_name": "tenant1"}),
+        )
+        scheduler = TenantDatabaseScheduler(app=self.app, lazy=True)
+        scheduler.producer = None
+        schedule = scheduler.all_as_schedule()
+
+        before = time.time()
+        with patch.object(scheduler, "send_task") as send_task:
+            scheduler.apply_entry(schedule["all_tenants: task"])
+            scheduler.apply_entry(schedule["tenant1: task"])
+        self.assertEqual(send_task.call_count, 3)
+        for call in send_task.call_args_list:
+            headers = call.kwargs["headers"]
+            self.assertLessEqual(before, headers[metrics.DUE_AT_HEADER])
+            self.assertLessEqual(
+                headers[metrics.DUE_AT_HEADER], headers[metrics.DISPATCHED_AT_HEADER]
+            )
+
+    def test_due_at(self):
+        """Messages are stamped with the time their entry was due, not sent."""
+        PeriodicTask.objects.create(
+            name="tenant1: task",
+            task="test_task",
+            interval=IntervalSchedule.objects.create(
+                every=1, period=IntervalSchedule.DAYS
+            ),
+            last_run_at=timezone.now() - timedelta(days=2),
+            headers=json.dumps({"_schema_name": "tenant1"}),
+        )
+        # Closing connections would break the test case's transaction
+        for target in [
+            "django_celery_beat.schedulers.close_old_connections",
+            "django_tenants_celery_beat.schedulers.close_old_connections",
+        ]:
+            patcher = patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        scheduler = TenantDatabaseScheduler(app=self.app, lazy=True)
+        scheduler.producer = None
+        scheduler._heap_schedule = scheduler.schedule
+        due_at = time.time() - 30
+        scheduler._heap = [
+            event_t(due_at, 5, scheduler.schedule["tenant1: task"])
+        ]
+
+        with patch.object(scheduler, "send_task") as send_task:
+            scheduler.tick()
+        self.assertEqual(
+            send_task.call_args.kwargs["headers"][metrics.DUE_AT_HEADER], due_at
+        )
+
+    def test_worker_metrics(self):
+        """Workers record the dispatch lag, queue wait and run duration per tenant."""
+        metrics.connect_signals()
+        self.addCleanup(metrics.disconnect_signals)
+
+        @self.app.task(name="test_task", shared=False)
+        def test_task():
+            pass
+
+        now = time.time()
+        test_task.apply(
+            headers={
+                "_schema_name": "tenant1",
+                metrics.DUE_AT_HEADER: now - 3,
+                metrics.DISPATCHED_AT_HEADER: now - 1,
+            }
+        )
+        test_task.apply(headers={"_schema_name": "tenant2"})
+
+        sink = metrics.get_sink()
+        dispatch_lag = sink.get("dispatch_lag", "tenant1", "test_task")
+        self.assertEqual(dispatch_lag.count, 1)
+        self.assertAlmostEqual(dispatch_lag.sum, 2, places=3)
+        self.assertGreaterEqual(sink.get("queue_wait", "tenant1", "test_task").sum, 1)
+        self.assertEqual(sink.get("run_duration", "tenant1", "test_task").count, 1)
+        self.assertIsNone(
+            sink.get("run_duration", "tenant2", "test_task"),
+            "Tasks not sent by beat are not recorded",
+        )
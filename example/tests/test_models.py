@@ -1,11 +1,28 @@
 import json
-from unittest.mock import patch
+from unittest.mock import Mock, call, patch
 
 import pytz
-from django.test import TestCase
+from celery.schedules import crontab
+from django.db import connection
+from django.db.models import signals
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from tenancy.models import Tenant
-from django_celery_beat.models import CrontabSchedule, PeriodicTask, IntervalSchedule
+from django_celery_beat.models import (
+    CrontabSchedule,
+    IntervalSchedule,
+    PeriodicTask,
+    PeriodicTasks,
+)
+from django_tenants_celery_beat.models import TenantScheduleVersion, crontab_cache
+from django_tenants_celery_beat.utils import (
+    _tenant_entries,
+    generate_beat_schedule,
+    generate_tenant_beat_schedule,
+    sync_tenant_beat_schedule,
+    tenant_cache,
+)
 
 
 class PeriodicTaskTenantLink(TestCase):
@@ -21,12 +38,22 @@ class PeriodicTaskTenantLink(TestCase):
             ]
         )
 
+    def setUp(self):
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+
     def assert_linked(self, periodic_task, tenant, use_tz):
         self.assertEqual(
             periodic_task.periodic_task_tenant_link.tenant,
             tenant,
             "Tenant link established",
         )
+        self.assertEqual(
+            periodic_task.periodic_task_tenant_link.schema_name,
+            tenant.schema_name,
+            "Schema name denormalised",
+        )
         self.assertEqual(
             json.loads(periodic_task.headers).get("_schema_name"),
             tenant.schema_name,
@@ -147,6 +174,59 @@ class PeriodicTaskTenantLink(TestCase):
                 periodic_task.save()
                 self.assertTrue(link_save.called_once)
 
+    def test_align_queries(self):
+        """Align skips scheduler saves, and otherwise only fetches the link."""
+        PeriodicTask.objects.create(
+            name="test",
+            task="test_task",
+            crontab=CrontabSchedule.objects.create(),
+            headers=json.dumps({"_schema_name": "tenant1"}),
+        )
+
+        def link_queries(queries):
+            return [
+                query["sql"]
+                for query in queries
+                if "periodictasktenantlink" in query["sql"]
+            ]
+
+        with self.subTest("Scheduler fields"):
+            periodic_task = PeriodicTask.objects.get(name="test")
+            periodic_task.total_run_count += 1
+            with CaptureQueriesContext(connection) as queries:
+                periodic_task.save(update_fields=["last_run_at", "total_run_count"])
+            self.assertEqual(link_queries(queries), [])
+
+        with self.subTest("Other fields"):
+            periodic_task = PeriodicTask.objects.get(name="test")
+            with CaptureQueriesContext(connection) as queries:
+                periodic_task.save()
+            self.assertEqual(len(link_queries(queries)), 1)
+            self.assertFalse(
+                any('"tenancy_tenant"' in query["sql"] for query in queries),
+                "Tenant is not needed",
+            )
+
+    @override_settings(TENANT_BEAT_PARTIAL_RELOAD=True)
+    def test_publish_change(self):
+        """Each change is published once, including saves of the link."""
+        periodic_task = PeriodicTask.objects.create(
+            name="test",
+            task="test_task",
+            crontab=CrontabSchedule.objects.create(),
+            headers=json.dumps({"_schema_name": "tenant1"}),
+        )
+        version = TenantScheduleVersion.objects.get(schema_name="tenant1").version
+
+        with patch("django_tenants_celery_beat.models.notify.publish") as publish:
+            periodic_task.periodic_task_tenant_link.save()
+            periodic_task.save()
+        self.assertEqual(publish.call_args_list, [call(periodic_task.pk, "tenant1")] * 2)
+        self.assertEqual(
+            TenantScheduleVersion.objects.get(schema_name="tenant1").version,
+            version + 2,
+        )
+
     def test_save(self):
         """Save method should set timezone flag and update linked PeriodicTask.
 
@@ -228,3 +308,250 @@ class PeriodicTaskTenantLink(TestCase):
         self.assertEqual(
             periodic_task.crontab.id, tz_crontab.id, "Existing TZ aware crontab reused"
         )
+
+    def test_save_stale_cache(self):
+        """Saving a link uses the tenant's current timezone, not the cached one."""
+        periodic_task = PeriodicTask.objects.create(
+            name="test",
+            task="test_task",
+            crontab=CrontabSchedule.objects.create(hour=12),
+            headers=json.dumps(
+                {"_schema_name": "tenant1", "_use_tenant_timezone": True}
+            ),
+        )
+        self.assertIsNotNone(tenant_cache.get("tenant1"))
+        # Changed by another process, so this process's cache is out of date
+        Tenant.objects.filter(schema_name="tenant1").update(timezone="Asia/Tokyo")
+
+        link = type(periodic_task.periodic_task_tenant_link).objects.get(
+            periodic_task=periodic_task
+        )
+        link.save()
+        periodic_task.refresh_from_db()
+
+        self.assertEqual(link.tenant_timezone, pytz.timezone("Asia/Tokyo"))
+        self.assertEqual(periodic_task.crontab.schedule.tz, pytz.timezone("Asia/Tokyo"))
+
+    def test_align_all_tenants(self):
+        """Align should flag template PeriodicTasks and strip the header."""
+        periodic_task = PeriodicTask.objects.create(
+            name="all_tenants: template",
+            task="test_task",
+            crontab=CrontabSchedule.objects.create(hour="0"),
+            headers=json.dumps(
+                {
+                    "_schema_name": "public",
+                    "_use_tenant_timezone": False,
+                    "_all_tenants": True,
+                }
+            ),
+        )
+        self.assert_linked(periodic_task, self.tenants[0], False)
+        self.assertTrue(
+            periodic_task.periodic_task_tenant_link.all_tenants,
+            "Linked all tenants flag is True",
+        )
+        self.assertFalse(
+            "_all_tenants" in json.loads(periodic_task.headers),
+            "All tenants header removed",
+        )
+
+    def test_save_crontab_cache(self):
+        """Timezone-adjusted crontabs are looked up once, then served from cache."""
+        crontab_cache.clear()
+        self.addCleanup(crontab_cache.clear)
+        crontab = CrontabSchedule.objects.create(hour="6")
+        headers = json.dumps({"_schema_name": "tenant2", "_use_tenant_timezone": True})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first = PeriodicTask.objects.create(
+                name="first", task="test_task", crontab=crontab, headers=headers
+            )
+        with CaptureQueriesContext(connection) as queries:
+            second = PeriodicTask.objects.create(
+                name="second", task="test_task", crontab=crontab, headers=headers
+            )
+
+        self.assertNotEqual(first.crontab_id, crontab.id)
+        self.assertEqual(second.crontab_id, first.crontab_id)
+        self.assertFalse(
+            [
+                query
+                for query in queries.captured_queries
+                if '"django_celery_beat_crontabschedule"."minute" =' in query["sql"]
+            ],
+            "No crontab lookups by schedule",
+        )
+
+        with self.subTest("Invalidated on change"):
+            CrontabSchedule.objects.create(hour="7")
+            self.assertEqual(len(crontab_cache._ids), 0)
+
+    def test_crontab_cache_deleted(self):
+        """Crontabs deleted by another process are not served from cache."""
+        crontab_cache.clear()
+        self.addCleanup(crontab_cache.clear)
+        schedule = crontab(hour=6)
+        schedule.tz = pytz.timezone("US/Eastern")
+        with self.captureOnCommitCallbacks(execute=True):
+            crontab_id = crontab_cache.get_id(schedule)
+        # Without the signal that clears the cache in this process
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM django_celery_beat_crontabschedule WHERE id = %s",
+                [crontab_id],
+            )
+
+        new_crontab_id = crontab_cache.get_id(schedule)
+
+        self.assertNotEqual(new_crontab_id, crontab_id)
+        self.assertTrue(CrontabSchedule.objects.filter(pk=new_crontab_id).exists())
+
+
+class TenantPeriodicTasks(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Tenant.objects.bulk_create(
+            [
+                Tenant(name="Public", schema_name="public"),
+                Tenant(
+                    name="Tenant 1", schema_name="tenant1", timezone="Europe/London"
+                ),
+            ]
+        )
+
+    def setUp(self):
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+        patcher = patch.dict(
+            "django_tenants_celery_beat.utils._tenant_entries", clear=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        generate_beat_schedule(
+            {
+                "local": {
+                    "task": "test_task",
+                    "schedule": crontab(hour=12),
+                    "tenancy_options": {
+                        "public": True,
+                        "all_tenants": True,
+                        "use_tenant_timezone": True,
+                    },
+                },
+                "template": {
+                    "task": "test_task",
+                    "schedule": crontab(hour=12),
+                    "tenancy_options": {"all_tenants": True, "template": True},
+                },
+            }
+        )
+
+    def create_tenant(self):
+        tenant = Tenant(name="Tenant 2", schema_name="tenant2", timezone="US/Eastern")
+        tenant.auto_create_schema = False
+        tenant.save()
+        return tenant
+
+    def test_create_tenant(self):
+        """A new tenant gets its own PeriodicTasks for all tenant entries."""
+        tenant = self.create_tenant()
+
+        periodic_task = PeriodicTask.objects.get(
+            periodic_task_tenant_link__tenant=tenant
+        )
+        self.assertEqual(periodic_task.name, "tenant2: local")
+        self.assertEqual(
+            json.loads(periodic_task.headers), {"_schema_name": "tenant2"}
+        )
+        self.assertEqual(
+            periodic_task.crontab.schedule.tz, pytz.timezone("US/Eastern")
+        )
+
+    def test_create_tenant_other_process(self):
+        """Without a beat_schedule, a new tenant's PeriodicTasks are copied."""
+        sync_tenant_beat_schedule(beat_schedule=generate_tenant_beat_schedule("tenant1"))
+        self.create_tenant()
+        PeriodicTask.objects.create(
+            name="tenant2: custom",
+            task="test_task",
+            crontab=CrontabSchedule.objects.create(hour="1"),
+            headers=json.dumps({"_schema_name": "tenant2"}),
+        )
+        _tenant_entries.clear()
+
+        tenant = Tenant(name="Tenant 3", schema_name="tenant3", timezone="Asia/Tokyo")
+        tenant.auto_create_schema = False
+        with self.assertLogs("django_tenants_celery_beat.models", "WARNING"):
+            tenant.save()
+
+        periodic_task = PeriodicTask.objects.select_related("crontab").get(
+            periodic_task_tenant_link__tenant=tenant
+        )
+        self.assertEqual(periodic_task.name, "tenant3: local")
+        self.assertEqual(
+            json.loads(periodic_task.headers), {"_schema_name": "tenant3"}
+        )
+        self.assertEqual(periodic_task.crontab.schedule.tz, pytz.timezone("Asia/Tokyo"))
+        self.assertIsNone(periodic_task.last_run_at)
+
+    def test_delete_tenant(self):
+        """A deleted tenant's PeriodicTasks are removed and beat is notified."""
+        tenant = self.create_tenant()
+        last_change = PeriodicTasks.last_change()
+
+        with patch(
+            "django_tenants_celery_beat.models.PeriodicTasks.changed"
+        ) as changed, patch(
+            "django_tenants_celery_beat.models.publish_change"
+        ) as publish_change, patch(
+            "django_tenants_celery_beat.models.PeriodicTasks.update_changed",
+            wraps=PeriodicTasks.update_changed,
+        ) as update_changed:
+            tenant.delete()
+
+        self.assertFalse(PeriodicTask.objects.filter(name="tenant2: local").exists())
+        self.assertGreater(PeriodicTasks.last_change(), last_change)
+        # Marked as changed once, rather than per PeriodicTask
+        update_changed.assert_called_once_with()
+        changed.assert_not_called()
+        publish_change.assert_not_called()
+
+    def test_delete_tenant_cascade(self):
+        """A deleted tenant's PeriodicTasks are deleted with `delete`, not in the raw."""
+        tenant = self.create_tenant()
+        post_delete = Mock()
+        signals.post_delete.connect(post_delete, sender=PeriodicTask)
+        self.addCleanup(signals.post_delete.disconnect, post_delete, sender=PeriodicTask)
+
+        tenant.delete()
+
+        self.assertEqual(
+            {call.kwargs["instance"].name for call in post_delete.call_args_list},
+            {"tenant2: local"},
+        )
+
+    def test_update_tenant(self):
+        """A tenant's PeriodicTasks follow changes to its timezone."""
+        tenant = self.create_tenant()
+
+        # The UPDATE and a SELECT of the out of date links, each after a search_path
+        with self.assertNumQueries(4):
+            tenant.save()
+        with self.assertNumQueries(2):
+            tenant.save(update_fields=["name"])
+
+        tenant.timezone = "Asia/Tokyo"
+        tenant.save()
+
+        periodic_task = PeriodicTask.objects.select_related(
+            "periodic_task_tenant_link"
+        ).get(name="tenant2: local")
+        self.assertEqual(
+            periodic_task.periodic_task_tenant_link.tenant_timezone,
+            pytz.timezone("Asia/Tokyo"),
+        )
+        self.assertEqual(
+            periodic_task.crontab.schedule.tz, pytz.timezone("Asia/Tokyo")
+        )
@@ -0,0 +1,709 @@
+import json
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytz
+from celery import Celery
+from celery.schedules import crontab
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from django_celery_beat.models import (
+    CrontabSchedule,
+    IntervalSchedule,
+    PeriodicTask,
+    PeriodicTasks,
+)
+from django_tenants_celery_beat.models import TenantScheduleVersion
+from django_tenants_celery_beat.schedulers import TenantDatabaseScheduler
+from django_tenants_celery_beat.tasks import FAN_OUT_TASK
+from django_tenants_celery_beat.utils import (
+    generate_beat_schedule,
+    spread_offset,
+    sync_tenant_beat_schedule,
+    tenant_cache,
+)
+from tenancy.models import Tenant
+
+
+class TenantDatabaseSchedulerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tenants = Tenant.objects.bulk_create(
+            [
+                Tenant(name="Public", schema_name="public"),
+                Tenant(
+                    name="Tenant 1", schema_name="tenant1", timezone="Europe/London"
+                ),
+                Tenant(name="Tenant 2", schema_name="tenant2", timezone="US/Eastern"),
+                Tenant(name="Tenant 3", schema_name="tenant3", timezone="US/Eastern"),
+            ]
+        )
+
+    def setUp(self):
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+        self.app = Celery(set_as_current=False)
+        self.scheduler = TenantDatabaseScheduler(app=self.app, lazy=True)
+        self.scheduler.producer = None
+        # Closing connections would break the test case's transaction
+        for target in [
+            "django_celery_beat.schedulers.close_old_connections",
+            "django_tenants_celery_beat.schedulers.close_old_connections",
+        ]:
+            patcher = patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create_template(self, name, use_tenant_timezone=False):
+        return PeriodicTask.objects.create(
+            name=f"all_tenants: {name}",
+            task="test_task",
+            crontab=CrontabSchedule.objects.create(hour="12"),
+            headers=json.dumps(
+                {
+                    "_schema_name": "public",
+                    "_use_tenant_timezone": use_tenant_timezone,
+                    "_all_tenants": True,
+                }
+            ),
+        )
+
+    def test_setup_schedule(self):
+        """The beat_schedule is synced, along with the default entries."""
+        self.app.conf.beat_schedule = generate_beat_schedule(
+            {
+                "task": {
+                    "task": "test_task",
+                    "schedule": crontab(hour=12),
+                    "tenancy_options": {"all_tenants": True, "template": True},
+                },
+            }
+        )
+        self.scheduler.setup_schedule()
+
+        self.assertEqual(
+            set(self.scheduler.schedule),
+            {"all_tenants: task", "celery.backend_cleanup"},
+        )
+
+    def test_all_as_schedule(self):
+        """Templates are loaded once, or once per timezone if using tenant TZs."""
+        PeriodicTask.objects.create(
+            name="tenant1: single",
+            task="test_task",
+            crontab=CrontabSchedule.objects.create(hour="12"),
+            headers=json.dumps({"_schema_name": "tenant1"}),
+        )
+        self.create_template("utc")
+        self.create_template("local", use_tenant_timezone=True)
+
+        schedule = self.scheduler.all_as_schedule()
+
+        self.assertEqual(
+            set(schedule),
+            {
+                "tenant1: single",
+                "all_tenants: utc",
+                "all_tenants: local [Europe/London]",
+                "all_tenants: local [US/Eastern]",
+            },
+        )
+        self.assertFalse(schedule["tenant1: single"].all_tenants)
+        self.assertTrue(schedule["all_tenants: utc"].all_tenants)
+        self.assertEqual(
+            schedule["all_tenants: local [US/Eastern]"].schedule.tz,
+            pytz.timezone("US/Eastern"),
+            "Crontab is evaluated in the bucket's timezone",
+        )
+
+    def test_apply_entry_template(self):
+        """A due template is sent once to each matching tenant schema."""
+        self.create_template("utc")
+        self.create_template("local", use_tenant_timezone=True)
+        schedule = self.scheduler.all_as_schedule()
+
+        with patch.object(self.scheduler, "send_task") as send_task:
+            self.scheduler.apply_entry(schedule["all_tenants: utc"])
+            self.assertEqual(
+                sorted(
+                    call.kwargs["headers"]["_schema_name"]
+                    for call in send_task.call_args_list
+                ),
+                ["tenant1", "tenant2", "tenant3"],
+            )
+
+        with patch.object(self.scheduler, "send_task") as send_task:
+            self.scheduler.apply_entry(schedule["all_tenants: local [US/Eastern]"])
+            self.assertEqual(
+                sorted(
+                    call.kwargs["headers"]["_schema_name"]
+                    for call in send_task.call_args_list
+                ),
+                ["tenant2", "tenant3"],
+            )
+
+        self.assertEqual(
+            schedule["all_tenants: utc"].options["headers"]["_schema_name"],
+            "public",
+            "Template headers are left alone",
+        )
+
+    def test_tick(self):
+        """Every due entry is sent in one tick, without rescanning the schedule."""
+        daily = IntervalSchedule.objects.create(every=1, period=IntervalSchedule.DAYS)
+        for name, last_run_at in [
+            ("tenant1: due", timezone.now() - timedelta(days=2)),
+            ("tenant2: due", timezone.now() - timedelta(days=3)),
+            ("tenant3: not_due", timezone.now()),
+        ]:
+            PeriodicTask.objects.create(
+                name=name,
+                task="test_task",
+                interval=daily,
+                last_run_at=last_run_at,
+                headers=json.dumps({"_schema_name": name.split(":")[0]}),
+            )
+
+        with patch.object(self.scheduler, "apply_entry") as apply_entry:
+            delay = self.scheduler.tick()
+            self.assertEqual(
+                sorted(call.args[0].name for call in apply_entry.call_args_list),
+                ["tenant1: due", "tenant2: due"],
+            )
+            self.assertGreater(delay, 0, "Waits for the next entry")
+
+            apply_entry.reset_mock()
+            with patch.object(self.scheduler, "schedules_equal") as schedules_equal:
+                self.scheduler.tick()
+                self.assertFalse(apply_entry.called, "Sent entries are rescheduled")
+                self.assertFalse(schedules_equal.called, "Heap is not rebuilt")
+
+    def test_tick_due_now(self):
+        """An entry due again straight away is not put off for `max_interval`."""
+        PeriodicTask.objects.create(
+            name="tenant1: due",
+            task="test_task",
+            interval=IntervalSchedule.objects.create(
+                every=1, period=IntervalSchedule.DAYS
+            ),
+            headers=json.dumps({"_schema_name": "tenant1"}),
+        )
+
+        with patch.object(self.scheduler, "is_due", return_value=(False, 0)):
+            self.assertEqual(self.scheduler.tick(), 0)
+
+    def test_sync(self):
+        """Runs of every sent entry are written back in a single UPDATE."""
+        daily = IntervalSchedule.objects.create(every=1, period=IntervalSchedule.DAYS)
+        for tenant in self.tenants[1:]:
+            PeriodicTask.objects.create(
+                name=f"{tenant.schema_name}: due",
+                task="test_task",
+                interval=daily,
+                last_run_at=timezone.now() - timedelta(days=2),
+                headers=json.dumps({"_schema_name": tenant.schema_name}),
+            )
+
+        with patch.object(self.scheduler, "apply_entry"):
+            self.scheduler.tick()
+        with CaptureQueriesContext(connection) as queries:
+            self.scheduler.sync()
+
+        self.assertEqual(
+            len([query for query in queries if query["sql"].startswith("UPDATE")]), 1
+        )
+        self.assertFalse(self.scheduler._dirty)
+        self.assertEqual(
+            list(
+                PeriodicTask.objects.filter(name__endswith=": due").values_list(
+                    "total_run_count", flat=True
+                )
+            ),
+            [1, 1, 1],
+        )
+
+    def test_sync_schedule_changed(self):
+        """Runs are written back even if the schedule is reloaded while syncing."""
+        daily = IntervalSchedule.objects.create(every=1, period=IntervalSchedule.DAYS)
+        PeriodicTask.objects.create(
+            name="tenant1: due",
+            task="test_task",
+            interval=daily,
+            last_run_at=timezone.now() - timedelta(days=2),
+            headers=json.dumps({"_schema_name": "tenant1"}),
+        )
+        with patch.object(self.scheduler, "apply_entry") as apply_entry:
+            self.scheduler.tick()
+            self.assertTrue(apply_entry.called)
+            # Polls the last change, as beat would between ticks
+            self.scheduler.schedule
+
+            PeriodicTask.objects.create(
+                name="tenant2: unrelated",
+                task="test_task",
+                interval=daily,
+                headers=json.dumps({"_schema_name": "tenant2"}),
+            )
+            self.scheduler.sync()
+            self.assertEqual(
+                PeriodicTask.objects.get(name="tenant1: due").total_run_count, 1
+            )
+
+            apply_entry.reset_mock()
+            self.scheduler.tick()
+            self.assertFalse(apply_entry.called, "The run is not repeated")
+
+    @override_settings(TENANT_BEAT_BUCKET_BY_TIMEZONE=True)
+    def test_bucket_by_timezone(self):
+        """Tenant tasks firing at the same time are held and sent as one entry."""
+        sync_tenant_beat_schedule(
+            beat_schedule=generate_beat_schedule(
+                {
+                    "local": {
+                        "task": "test_task",
+                        "schedule": crontab(hour=12),
+                        "tenancy_options": {
+                            "all_tenants": True,
+                            "use_tenant_timezone": True,
+                        },
+                    },
+                }
+            )
+        )
+
+        schedule = self.scheduler.all_as_schedule()
+
+        self.assertEqual(len(schedule), 2)
+        self.assertIn("tenant1: local", schedule)
+        [bucket] = [entry for entry in schedule.values() if entry.fans_out]
+        with patch.object(self.scheduler, "send_task") as send_task:
+            self.scheduler.apply_entry(bucket)
+            self.assertEqual(
+                sorted(
+                    call.kwargs["headers"]["_schema_name"]
+                    for call in send_task.call_args_list
+                ),
+                ["tenant2", "tenant3"],
+            )
+
+        self.scheduler._schedule = schedule
+        self.scheduler.reserve(bucket)
+        self.scheduler.sync()
+        self.assertEqual(
+            list(
+                PeriodicTask.objects.filter(
+                    name__in=["tenant2: local", "tenant3: local"]
+                ).values_list("total_run_count", flat=True)
+            ),
+            [1, 1],
+            "Run is recorded for every tenant",
+        )
+
+    def test_fanout_chunks(self):
+        """Large fan-outs are sent a chunk at a time, one chunk per tick."""
+        self.create_template("utc")
+        self.scheduler.fanout_chunk_size = 2
+        entry = self.scheduler.all_as_schedule()["all_tenants: utc"]
+
+        with patch.object(self.scheduler, "send_task") as send_task:
+            self.scheduler.apply_entry(entry)
+            self.assertEqual(send_task.call_count, 2)
+
+            self.scheduler.tick()
+            self.assertEqual(send_task.call_count, 3)
+            self.assertFalse(self.scheduler._fanouts, "Fan-out is complete")
+
+    def test_spread_seconds(self):
+        """Each tenant's run is delayed by its own offset within the window."""
+        template = self.create_template("utc")
+        template.headers = json.dumps(
+            {**json.loads(template.headers), "_spread_seconds": 600}
+        )
+        template.expire_seconds = 60
+        template.save()
+        entry = self.scheduler.all_as_schedule()["all_tenants: utc"]
+        self.assertNotIn("_spread_seconds", entry.options["headers"])
+
+        with patch.object(self.scheduler, "send_task") as send_task:
+            self.scheduler.apply_entry(entry)
+            for call in send_task.call_args_list:
+                offset = spread_offset(call.kwargs["headers"]["_schema_name"], 600)
+                self.assertEqual(call.kwargs["countdown"], offset)
+                self.assertEqual(call.kwargs["expires"], 60 + offset)
+
+    def test_shards(self):
+        """Each shard loads its tenants' tasks, and sends templates to them only."""
+        for tenant in self.tenants[1:]:
+            PeriodicTask.objects.create(
+                name=f"{tenant.schema_name}: task",
+                task="test_task",
+                crontab=CrontabSchedule.objects.create(hour="12"),
+                headers=json.dumps({"_schema_name": tenant.schema_name}),
+            )
+        self.create_template("utc")
+
+        sent = []
+        for shard_index in range(2):
+            scheduler = TenantDatabaseScheduler(
+                app=self.app, lazy=True, shard_index=shard_index, shard_count=2
+            )
+            scheduler.producer = None
+            schedule = scheduler.all_as_schedule()
+            tenant_tasks = {
+                name.split(":")[0] for name in schedule if name != "all_tenants: utc"
+            }
+            with patch.object(scheduler, "send_task") as send_task:
+                scheduler.apply_entry(schedule["all_tenants: utc"])
+            schema_names = {
+                call.kwargs["headers"]["_schema_name"]
+                for call in send_task.call_args_list
+            }
+            self.assertEqual(tenant_tasks, schema_names)
+            self.assertTrue(
+                all(
+                    tenant_cache.get(schema_name).pk % 2 == shard_index
+                    for schema_name in schema_names
+                )
+            )
+            sent.extend(schema_names)
+
+        self.assertEqual(sorted(sent), ["tenant1", "tenant2", "tenant3"])
+
+    def test_shard_template_runs(self):
+        """A shard's template runs are not overridden by another shard's on reload."""
+        template = self.create_template("utc")
+        template.crontab = None
+        template.interval = IntervalSchedule.objects.create(
+            every=1, period=IntervalSchedule.DAYS
+        )
+        template.last_run_at = timezone.now() - timedelta(days=2)
+        template.save()
+        scheduler = TenantDatabaseScheduler(
+            app=self.app, lazy=True, shard_index=1, shard_count=2
+        )
+        scheduler.producer = None
+        self.assertIn("all_tenants: utc", scheduler.schedule)
+
+        # Run by another shard
+        PeriodicTask.objects.filter(pk=template.pk).update(last_run_at=timezone.now())
+        scheduler._initial_read = True
+        with patch.object(scheduler, "apply_entry") as apply_entry:
+            scheduler.tick()
+        self.assertEqual(
+            [call.args[0].name for call in apply_entry.call_args_list],
+            ["all_tenants: utc"],
+        )
+
+    def test_shard_setup_schedule(self):
+        """Only shard 0 syncs the beat_schedule."""
+        with patch(
+            "django_tenants_celery_beat.schedulers.sync_tenant_beat_schedule"
+        ) as sync:
+            for shard_index in range(2):
+                TenantDatabaseScheduler(
+                    app=self.app, lazy=True, shard_index=shard_index, shard_count=2
+                ).setup_schedule()
+            self.assertEqual(sync.call_count, 1)
+
+        with self.assertRaises(ImproperlyConfigured):
+            TenantDatabaseScheduler(
+                app=self.app, lazy=True, shard_index=2, shard_count=2
+            )
+
+    @override_settings(TENANT_BEAT_LEADER_ELECTION=True)
+    def test_leader_election(self):
+        """Only the leader sends tasks, and a standby takes over once it's gone."""
+        daily = IntervalSchedule.objects.create(every=1, period=IntervalSchedule.DAYS)
+        PeriodicTask.objects.create(
+            name="tenant1: due",
+            task="test_task",
+            interval=daily,
+            last_run_at=timezone.now() - timedelta(days=2),
+            headers=json.dumps({"_schema_name": "tenant1"}),
+        )
+        leader = TenantDatabaseScheduler(app=self.app, lazy=True)
+        self.addCleanup(leader.leader_lock.release)
+        standby = TenantDatabaseScheduler(app=self.app, lazy=True)
+        self.addCleanup(standby.leader_lock.release)
+        for scheduler in [leader, standby]:
+            scheduler.producer = None
+            scheduler.leader_interval = 0
+
+        with patch.object(leader, "apply_entry") as leader_apply:
+            leader.tick()
+            self.assertTrue(leader_apply.called)
+        with patch.object(standby, "apply_entry") as standby_apply:
+            self.assertEqual(standby.tick(), 0)
+            self.assertFalse(standby_apply.called)
+            self.assertFalse(standby.is_leader)
+
+            leader.close()
+            standby.tick()
+            self.assertTrue(standby.is_leader)
+            self.assertFalse(
+                standby_apply.called, "Run recorded by the leader is not repeated"
+            )
+
+    @override_settings(TENANT_BEAT_DUE_QUERY=True)
+    def test_due_query(self):
+        """Tenant tasks are fetched by their next run time, and only when due."""
+        scheduler = TenantDatabaseScheduler(app=self.app, lazy=True)
+        scheduler.producer = None
+        daily = IntervalSchedule.objects.create(every=1, period=IntervalSchedule.DAYS)
+        for name, last_run_at in [
+            ("tenant1: due", timezone.now() - timedelta(days=2)),
+            ("tenant2: not_due", timezone.now()),
+        ]:
+            PeriodicTask.objects.create(
+                name=name,
+                task="test_task",
+                interval=daily,
+                last_run_at=last_run_at,
+                headers=json.dumps({"_schema_name": name.split(":")[0]}),
+            )
+        self.create_template("utc")
+        self.assertEqual(set(scheduler.all_as_schedule()), {"all_tenants: utc"})
+
+        with patch.object(scheduler, "apply_entry") as apply_entry:
+            delay = scheduler.tick()
+            self.assertEqual(
+                [call.args[0].name for call in apply_entry.call_args_list],
+                ["tenant1: due"],
+            )
+            self.assertEqual(delay, scheduler.max_interval)
+            due = PeriodicTask.objects.select_related(
+                "periodic_task_tenant_link"
+            ).get(name="tenant1: due")
+            self.assertEqual(due.total_run_count, 1)
+            self.assertAlmostEqual(
+                due.periodic_task_tenant_link.next_run_at,
+                due.last_run_at + timedelta(days=1),
+                delta=timedelta(seconds=5),
+            )
+
+            apply_entry.reset_mock()
+            with CaptureQueriesContext(connection) as queries:
+                scheduler.send_due_tasks()
+            self.assertFalse(apply_entry.called)
+            self.assertFalse(
+                [query for query in queries if query["sql"].startswith("UPDATE")],
+                "Nothing is fetched or written until a task is due",
+            )
+
+        due.description = "changed"
+        due.save()
+        due.periodic_task_tenant_link.refresh_from_db()
+        self.assertIsNone(
+            due.periodic_task_tenant_link.next_run_at, "Changes clear the next run"
+        )
+
+    @override_settings(TENANT_BEAT_DUE_QUERY=True)
+    def test_due_query_default_entries(self):
+        """Default entries are fetched when due, and only sent once."""
+        scheduler = TenantDatabaseScheduler(app=self.app, lazy=True)
+        scheduler.producer = None
+        PeriodicTask.objects.create(
+            name="celery.backend_cleanup",
+            task="celery.backend_cleanup",
+            crontab=CrontabSchedule.objects.create(minute="0", hour="4"),
+            last_run_at=timezone.now() - timedelta(days=2),
+        )
+        self.app.conf.beat_schedule = {}
+        scheduler.setup_schedule()
+
+        self.assertNotIn("celery.backend_cleanup", scheduler.schedule)
+        with patch.object(scheduler, "apply_entry") as apply_entry:
+            scheduler.tick()
+        self.assertEqual(
+            [call.args[0].name for call in apply_entry.call_args_list],
+            ["celery.backend_cleanup"],
+        )
+
+    @override_settings(TENANT_BEAT_DUE_QUERY=True)
+    def test_due_query_invalid(self):
+        """Tenant tasks that cannot be loaded are not fetched again until changed."""
+        scheduler = TenantDatabaseScheduler(app=self.app, lazy=True)
+        scheduler.producer = None
+        invalid = PeriodicTask.objects.create(
+            name="tenant1: invalid",
+            task="test_task",
+            interval=IntervalSchedule.objects.create(
+                every=1, period=IntervalSchedule.DAYS
+            ),
+            headers=json.dumps({"_schema_name": "tenant1"}),
+        )
+        PeriodicTask.objects.filter(pk=invalid.pk).update(headers="{invalid")
+
+        with patch.object(scheduler, "apply_entry") as apply_entry:
+            with self.assertLogs("django_tenants_celery_beat.schedulers", "ERROR"):
+                scheduler.send_due_tasks()
+            with CaptureQueriesContext(connection) as queries:
+                scheduler.send_due_tasks()
+        self.assertFalse(apply_entry.called)
+        self.assertFalse(
+            [query for query in queries if query["sql"].startswith("UPDATE")],
+            "The task is not fetched again",
+        )
+        invalid.refresh_from_db()
+        self.assertGreater(
+            invalid.periodic_task_tenant_link.next_run_at,
+            timezone.now() + timedelta(days=365),
+        )
+
+    @override_settings(TENANT_BEAT_PARTIAL_RELOAD=True)
+    def test_partial_reload(self):
+        """Only the tenants whose version advanced are reloaded."""
+        scheduler = TenantDatabaseScheduler(app=self.app, lazy=True)
+        scheduler.producer = None
+        daily = IntervalSchedule.objects.create(every=1, period=IntervalSchedule.DAYS)
+        tasks = [
+            PeriodicTask.objects.create(
+                name=f"{schema_name}: task",
+                task="test_task",
+                interval=daily,
+                last_run_at=last_run_at,
+                headers=json.dumps({"_schema_name": schema_name}),
+            )
+            for schema_name, last_run_at in [
+                ("tenant1", timezone.now()),
+                ("tenant2", timezone.now() - timedelta(days=2)),
+            ]
+        ]
+        with patch.object(scheduler, "apply_entry") as apply_entry:
+            scheduler.tick()
+        self.assertEqual(
+            [call.args[0].name for call in apply_entry.call_args_list],
+            ["tenant2: task"],
+        )
+        unchanged = scheduler.schedule["tenant2: task"]
+
+        version = TenantScheduleVersion.objects.get(schema_name="tenant1").version
+        last_change = PeriodicTasks.last_change()
+        tasks[0].name = "tenant1: renamed"
+        tasks[0].save()
+        self.assertEqual(
+            PeriodicTasks.last_change(),
+            last_change,
+            "Versioned changes don't mark the whole schedule as changed",
+        )
+        self.assertEqual(
+            TenantScheduleVersion.objects.get(schema_name="tenant1").version,
+            version + 1,
+        )
+
+        with patch.object(
+            scheduler, "all_as_schedule", wraps=scheduler.all_as_schedule
+        ) as all_as_schedule:
+            with patch.object(scheduler, "apply_entry") as apply_entry:
+                scheduler.tick()
+            self.assertFalse(
+                apply_entry.called, "Entries run before the reload are not due again"
+            )
+            self.assertEqual(
+                set(scheduler.schedule), {"tenant1: renamed", "tenant2: task"}
+            )
+            self.assertIs(scheduler.schedule["tenant2: task"], unchanged)
+
+            tasks[1].delete()
+            scheduler.tick()
+            self.assertEqual(set(scheduler.schedule), {"tenant1: renamed"})
+            self.assertFalse(all_as_schedule.called)
+
+    def test_coordinator(self):
+        """A coordinator template is sent as a single fan_out message."""
+        template = self.create_template("local", use_tenant_timezone=True)
+        template.headers = json.dumps(
+            {**json.loads(template.headers), "_chunk_size": 2}
+        )
+        template.queue = "tenants"
+        template.save()
+        entry = self.scheduler.all_as_schedule()["all_tenants: local [US/Eastern]"]
+        self.assertNotIn("_chunk_size", entry.options["headers"])
+
+        with patch.object(self.scheduler, "send_task") as send_task:
+            self.scheduler.apply_entry(entry)
+        [call] = send_task.call_args_list
+        self.assertEqual(call.args[0], FAN_OUT_TASK)
+        self.assertEqual(call.args[1], ("test_task", [], {}))
+        self.assertEqual(call.args[2]["chunk_size"], 2)
+        self.assertEqual(call.args[2]["timezone"], "US/Eastern")
+        self.assertEqual(call.args[2]["options"], {"queue": "tenants"})
+        self.assertEqual(call.kwargs["queue"], "tenants")
+
+
+@override_settings(TENANT_BEAT_NOTIFY=True)
+class NotifyTestCase(TransactionTestCase):
+    # Notifications are only delivered once the changes are committed
+
+    def setUp(self):
+        Tenant.objects.bulk_create(
+            [
+                Tenant(name="Public", schema_name="public"),
+                Tenant(name="Tenant 1", schema_name="tenant1"),
+            ]
+        )
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+        self.app = Celery(set_as_current=False)
+        self.daily = IntervalSchedule.objects.create(
+            every=1, period=IntervalSchedule.DAYS
+        )
+
+    def create_task(self, name):
+        return PeriodicTask.objects.create(
+            name=f"tenant1: {name}",
+            task="test_task",
+            interval=self.daily,
+            last_run_at=timezone.now(),
+            headers=json.dumps({"_schema_name": "tenant1"}),
+        )
+
+    def test_apply_changes(self):
+        """Published changes are applied to the schedule without a full reload."""
+        changed, deleted = self.create_task("changed"), self.create_task("deleted")
+        scheduler = TenantDatabaseScheduler(app=self.app, lazy=True)
+        self.addCleanup(scheduler.listener.close)
+        scheduler.producer = None
+        scheduler.tick()
+        self.assertEqual(
+            set(scheduler.schedule), {"tenant1: changed", "tenant1: deleted"}
+        )
+
+        last_change = PeriodicTasks.last_change()
+        changed.name = "tenant1: renamed"
+        changed.save()
+        deleted.delete()
+        self.create_task("created")
+        self.assertEqual(
+            PeriodicTasks.last_change(),
+            last_change,
+            "Published changes don't mark the whole schedule as changed",
+        )
+
+        expected = {"tenant1: renamed", "tenant1: created"}
+        with patch.object(
+            scheduler, "all_as_schedule", wraps=scheduler.all_as_schedule
+        ) as all_as_schedule:
+            for _ in range(50):
+                scheduler.tick()
+                if set(scheduler.schedule) == expected:
+                    break
+                time.sleep(0.02)
+            self.assertEqual(set(scheduler.schedule), expected)
+            self.assertFalse(all_as_schedule.called)
+
+    def test_fallback(self):
+        """Without Postgres, changes mark the schedule as changed as usual."""
+        with patch.object(connection, "vendor", "sqlite"):
+            scheduler = TenantDatabaseScheduler(app=self.app, lazy=True)
+            self.assertIsNone(scheduler.listener)
+            last_change = PeriodicTasks.last_change()
+            self.create_task("created")
+            self.assertNotEqual(PeriodicTasks.last_change(), last_change)
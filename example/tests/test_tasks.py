@@ -0,0 +1,140 @@
+from unittest.mock import patch
+
+from celery import Celery, group
+from django.db import connection
+from django.test import TestCase
+# Connects the signals switching schemas, as in workers
+import tenant_schemas_celery.app  # noqa: F401
+
+from django_tenants_celery_beat.tasks import (
+    FAN_OUT_TASK,
+    RUN_FOR_SCHEMAS_TASK,
+    TenantBatchTask,
+)
+from django_tenants_celery_beat.utils import tenant_cache
+from tenancy.models import Tenant
+
+
+class CoordinatorTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Tenant.objects.bulk_create(
+            [Tenant(name="Public", schema_name="public")]
+            + [
+                Tenant(
+                    name=f"Tenant {i}",
+                    schema_name=f"tenant{i}",
+                    timezone="US/Eastern" if i % 2 else "UTC",
+                )
+                for i in range(1, 6)
+            ]
+        )
+
+    def setUp(self):
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+        self.app = Celery(set_as_current=False)
+        self.app.conf.task_always_eager = True
+        self.runs = runs = []
+
+        @self.app.task(name="test_task", bind=True, shared=False)
+        def test_task(self, x):
+            schema_name = self.request.headers["_schema_name"]
+            if schema_name == "tenant2":
+                raise ValueError("Broken tenant")
+            runs.append((schema_name, x, self.request.headers.get("custom")))
+
+    def test_fan_out(self):
+        """Tenants are run in chunks, and one failing tenant doesn't stop the rest."""
+        with patch("django_tenants_celery_beat.tasks.group", wraps=group) as chunks:
+            result = self.app.tasks[FAN_OUT_TASK].apply(
+                ("test_task", [1], {}),
+                {"chunk_size": 2, "headers": {"custom": "header"}},
+            )
+        self.assertEqual(result.get(), 5)
+        self.assertEqual(
+            [len(sig.args[1]) for sig in chunks.call_args.args[0]],
+            [2, 2, 1],
+            "Chunks of up to 2 tenants",
+        )
+        self.assertEqual(
+            sorted(self.runs), [(f"tenant{i}", 1, "header") for i in [1, 3, 4, 5]]
+        )
+
+    def test_fan_out_timezone(self):
+        """Only tenants in the given timezone are included."""
+        result = self.app.tasks[FAN_OUT_TASK].apply(
+            ("test_task", [1], {}), {"chunk_size": 50, "timezone": "UTC"}
+        )
+        self.assertEqual(result.get(), 2)
+        self.assertEqual(self.runs, [("tenant4", 1, None)])
+
+    def test_fan_out_batch_task(self):
+        """Batch tasks run in each tenant's schema, on the worker's connection."""
+        runs = []
+
+        @self.app.task(name="batch_task", base=TenantBatchTask, shared=False)
+        def batch_task(x):
+            runs.append((connection.schema_name, connection.tenant.schema_name, x))
+
+        result = self.app.tasks[FAN_OUT_TASK].apply(
+            ("batch_task", [1], {}), {"chunk_size": 2}
+        )
+
+        self.assertEqual(result.get(), 5)
+        self.assertEqual(
+            sorted(runs), [(f"tenant{i}", f"tenant{i}", 1) for i in range(1, 6)]
+        )
+        self.assertEqual(connection.schema_name, "public", "Schema is restored")
+
+
+class TenantBatchTaskTestCase(TestCase):
+    def setUp(self):
+        self.app = Celery(set_as_current=False)
+        self.app.conf.task_always_eager = True
+        self.runs = runs = []
+
+        @self.app.task(name="batch_task", base=TenantBatchTask, shared=False)
+        def batch_task(x):
+            if connection.schema_name == "tenant2":
+                raise ValueError("Broken tenant")
+            runs.append((connection.schema_name, x))
+
+        self.task = batch_task
+
+    def test_schema_names_header(self):
+        """The body runs in each schema in turn, isolating failures."""
+        result = self.task.apply(
+            (1,), headers={"_schema_names": ["tenant1", "tenant2", "tenant3"]}
+        )
+        self.assertEqual(result.get(), ["tenant2"])
+        self.assertEqual(self.runs, [("tenant1", 1), ("tenant3", 1)])
+        self.assertEqual(connection.schema_name, "public", "Schema is restored")
+
+    def test_single_schema(self):
+        """Without the header, the task runs as usual."""
+        self.task.apply((1,))
+        self.assertEqual(self.runs, [("public", 1)])
+
+    def test_schema_name_header(self):
+        """Sent to a single tenant, the task runs in its schema."""
+        Tenant.objects.bulk_create(
+            [
+                Tenant(name="Public", schema_name="public"),
+                Tenant(name="Tenant 1", schema_name="tenant1"),
+            ]
+        )
+        self.task.apply((1,), headers={"_schema_name": "tenant1"})
+        self.assertEqual(self.runs, [("tenant1", 1)])
+        self.assertEqual(connection.schema_name, "public", "Schema is restored")
+
+    def test_run_for_schemas(self):
+        """Coordinator chunks run batch tasks without applying each run."""
+        with patch.object(self.task, "apply") as apply:
+            result = self.app.tasks[RUN_FOR_SCHEMAS_TASK].apply(
+                ("batch_task", ["tenant1", "tenant2"], [1])
+            )
+            self.assertFalse(apply.called)
+        self.assertEqual(result.get(), ["tenant2"])
+        self.assertEqual(self.runs, [("tenant1", 1)])
@@ -1,7 +1,22 @@
+import json
+from unittest.mock import patch
+
+import pytz
+from celery import Celery
 from celery.schedules import crontab
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
-from django_tenants_celery_beat.utils import generate_beat_schedule
+from django_celery_beat.models import PeriodicTask
+from django_tenants_celery_beat.utils import (
+    generate_beat_schedule,
+    generate_tenant_beat_schedule,
+    iter_beat_schedule,
+    spread_offset,
+    sync_tenant_beat_schedule,
+    tenant_cache,
+    TenantCache,
+)
 from tenancy.models import Tenant
 
 
@@ -15,6 +30,16 @@ class GenerateBeatScheduleTestCase(TestCase):
             ]
         )
 
+    def setUp(self):
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+        patcher = patch.dict(
+            "django_tenants_celery_beat.utils._tenant_entries", clear=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_public(self):
         expected = {
             "task_name": {
@@ -148,3 +173,311 @@ class GenerateBeatScheduleTestCase(TestCase):
             }
         )
         self.assertEqual(beat_schedule, expected)
+
+    def test_template(self):
+        expected = {
+            "all_tenants: task_name": {
+                "task": "core.tasks.test_task",
+                "schedule": crontab(0, 1),
+                "options": {
+                    "headers": {
+                        "_schema_name": "public",
+                        "_use_tenant_timezone": True,
+                        "_all_tenants": True,
+                    }
+                }
+            }
+        }
+        beat_schedule = generate_beat_schedule(
+            {
+                "task_name": {
+                    "task": "core.tasks.test_task",
+                    "schedule": crontab(0, 1),
+                    "tenancy_options": {
+                        "public": False,
+                        "all_tenants": True,
+                        "use_tenant_timezone": True,
+                        "template": True,
+                    }
+                },
+            }
+        )
+        self.assertEqual(beat_schedule, expected)
+
+    def test_spread_seconds(self):
+        beat_schedule = generate_beat_schedule(
+            {
+                "task_name": {
+                    "task": "core.tasks.test_task",
+                    "schedule": crontab(0, 1),
+                    "tenancy_options": {
+                        "all_tenants": True,
+                        "template": True,
+                        "spread_seconds": 600,
+                    }
+                },
+            }
+        )
+        self.assertEqual(
+            beat_schedule["all_tenants: task_name"]["options"]["headers"][
+                "_spread_seconds"
+            ],
+            600,
+        )
+        offset = spread_offset("tenant1", 600)
+        self.assertEqual(offset, spread_offset("tenant1", 600))
+        self.assertTrue(0 <= offset < 600)
+
+    def test_coordinator(self):
+        beat_schedule = generate_beat_schedule(
+            {
+                "task_name": {
+                    "task": "core.tasks.test_task",
+                    "schedule": crontab(0, 1),
+                    "tenancy_options": {
+                        "all_tenants": True,
+                        "fanout": "coordinator",
+                        "chunk_size": 20,
+                    }
+                },
+            }
+        )
+        self.assertEqual(list(beat_schedule), ["all_tenants: task_name"])
+        headers = beat_schedule["all_tenants: task_name"]["options"]["headers"]
+        self.assertTrue(headers["_all_tenants"])
+        self.assertEqual(headers["_chunk_size"], 20)
+
+    def test_shared_config(self):
+        """The config is left alone and schedules are shared, not copied."""
+        schedule = crontab(0, 1)
+        config = {
+            "task_name": {
+                "task": "core.tasks.test_task",
+                "schedule": schedule,
+                "options": {"headers": {"extra": "header"}},
+                "tenancy_options": {"all_tenants": True},
+            },
+        }
+        beat_schedule = generate_beat_schedule(config)
+
+        self.assertIn("tenancy_options", config["task_name"])
+        self.assertEqual(config["task_name"]["options"], {"headers": {"extra": "header"}})
+        self.assertIs(beat_schedule["tenant1: task_name"]["schedule"], schedule)
+        self.assertIs(beat_schedule["tenant2: task_name"]["schedule"], schedule)
+
+    def test_iter(self):
+        """Entries are generated lazily, querying the tenants once."""
+        entries = iter_beat_schedule(
+            {
+                name: {
+                    "task": "core.tasks.test_task",
+                    "schedule": crontab(),
+                    "tenancy_options": {"all_tenants": True},
+                }
+                for name in ["a", "b"]
+            }
+        )
+        with self.assertNumQueries(2):
+            names = [next(entries)[0]]
+        with self.assertNumQueries(0):
+            names.extend(name for name, _ in entries)
+        self.assertEqual(
+            sorted(names), ["tenant1: a", "tenant1: b", "tenant2: a", "tenant2: b"]
+        )
+
+    def test_tenant_entries(self):
+        """Only the tenant entries of the last beat_schedule are kept."""
+        generate_beat_schedule(
+            {
+                name: {
+                    "task": "core.tasks.test_task",
+                    "schedule": crontab(),
+                    "tenancy_options": {"all_tenants": True},
+                }
+                for name in ["a", "b"]
+            }
+        )
+        self.assertEqual(
+            sorted(generate_tenant_beat_schedule("tenant3")),
+            ["tenant3: a", "tenant3: b"],
+        )
+
+        generate_beat_schedule(
+            {
+                "b": {
+                    "task": "core.tasks.test_task",
+                    "schedule": crontab(),
+                    "tenancy_options": {"all_tenants": True},
+                },
+            }
+        )
+        self.assertEqual(list(generate_tenant_beat_schedule("tenant3")), ["tenant3: b"])
+
+    def test_iter_tenant_entries(self):
+        """Iterating over a beat_schedule leaves the tenant entries alone."""
+        list(
+            iter_beat_schedule(
+                {
+                    "a": {
+                        "task": "core.tasks.test_task",
+                        "schedule": crontab(),
+                        "tenancy_options": {"all_tenants": True},
+                    },
+                }
+            )
+        )
+        self.assertEqual(generate_tenant_beat_schedule("tenant3"), {})
+
+
+class SyncTenantBeatScheduleTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tenants = Tenant.objects.bulk_create(
+            [
+                Tenant(name="Public", schema_name="public"),
+                Tenant(name="Tenant 1", schema_name="tenant1", timezone="Europe/London"),
+                Tenant(name="Tenant 2", schema_name="tenant2", timezone="US/Eastern"),
+            ]
+        )
+
+    def setUp(self):
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+        self.app = Celery(set_as_current=False)
+        self.app.conf.beat_schedule = generate_beat_schedule(
+            {
+                "local": {
+                    "task": "core.tasks.test_task",
+                    "schedule": crontab(0, 1),
+                    "options": {"headers": {"extra": "header"}},
+                    "tenancy_options": {
+                        "public": True,
+                        "all_tenants": True,
+                        "use_tenant_timezone": True,
+                    },
+                },
+                "interval": {
+                    "task": "core.tasks.test_task",
+                    "schedule": 60,
+                    "tenancy_options": {"all_tenants": True},
+                },
+            }
+        )
+
+    def test_sync(self):
+        """Synced PeriodicTasks are linked and aligned with their tenants."""
+        names = sync_tenant_beat_schedule(self.app)
+
+        self.assertEqual(set(names), set(self.app.conf.beat_schedule))
+        for tenant in self.tenants:
+            periodic_task = PeriodicTask.objects.get(
+                periodic_task_tenant_link__tenant=tenant, crontab__isnull=False
+            )
+            use_tz = tenant.schema_name != "public"
+            self.assertEqual(
+                json.loads(periodic_task.headers),
+                {"extra": "header", "_schema_name": tenant.schema_name},
+                "Schema name header set and tenancy headers removed",
+            )
+            self.assertEqual(
+                periodic_task.periodic_task_tenant_link.use_tenant_timezone, use_tz
+            )
+            self.assertEqual(
+                periodic_task.periodic_task_tenant_link.schema_name, tenant.schema_name
+            )
+            self.assertEqual(
+                periodic_task.crontab.schedule.tz,
+                pytz.timezone(tenant.timezone) if use_tz else pytz.utc,
+            )
+        self.assertEqual(
+            PeriodicTask.objects.filter(interval__every=60).count(), 2
+        )
+
+    def test_sync_queries(self):
+        """A fixed number of queries is made, whatever the number of tenants."""
+        with self.assertNumQueries(26):
+            sync_tenant_beat_schedule(self.app)
+
+        with self.subTest("Unchanged"), self.assertNumQueries(10):
+            sync_tenant_beat_schedule(self.app)
+
+        with self.subTest("Changed"):
+            for name, entry in self.app.conf.beat_schedule.items():
+                entry["options"]["headers"]["extra"] = "changed"
+            with self.assertNumQueries(16):
+                sync_tenant_beat_schedule(self.app)
+            self.assertFalse(
+                PeriodicTask.objects.exclude(headers__contains="changed").filter(
+                    name__in=self.app.conf.beat_schedule
+                ).exists()
+            )
+
+
+class TenantCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tenants = Tenant.objects.bulk_create(
+            [
+                Tenant(name="Public", schema_name="public"),
+                Tenant(name="Tenant 1", schema_name="tenant1", timezone="US/Eastern"),
+            ]
+        )
+
+    def setUp(self):
+        # Tenants are bulk created, without clearing the cache
+        tenant_cache.clear()
+        self.addCleanup(tenant_cache.clear)
+
+    def test_get(self):
+        """All tenants are loaded at once, then looked up without queries."""
+        with self.assertNumQueries(2):
+            tenant = tenant_cache.get("tenant1")
+        with self.assertNumQueries(0):
+            self.assertEqual(tenant_cache.get("tenant1"), tenant)
+            self.assertEqual(tenant_cache.get_by_pk(self.tenants[1].pk), tenant)
+            self.assertIsNone(tenant_cache.get("missing"))
+        self.assertEqual(
+            tenant,
+            (self.tenants[1].pk, "tenant1", pytz.timezone("US/Eastern"), "Tenant 1"),
+        )
+
+    def test_invalidation(self):
+        """Saving or deleting a tenant clears the cache."""
+        tenant_cache.all()
+        tenant = self.tenants[1]
+        tenant.auto_create_schema = False
+        tenant.timezone = "Asia/Tokyo"
+        tenant.save()
+        self.assertEqual(
+            tenant_cache.get("tenant1").timezone, pytz.timezone("Asia/Tokyo")
+        )
+
+    @override_settings(TENANT_BEAT_TENANT_CACHE_TIMEOUT=0)
+    def test_timeout(self):
+        tenant_cache.all()
+        with self.assertNumQueries(2):
+            tenant_cache.all()
+
+    @override_settings(TENANT_BEAT_TENANT_CACHE="default")
+    def test_backend(self):
+        """The tenants can be shared between processes with a cache backend."""
+        tenant_cache.all()
+        self.assertIn("tenant1", cache.get(TenantCache.cache_key))
+        tenant_cache.clear()
+        self.assertIsNone(cache.get(TenantCache.cache_key))
+
+    @override_settings(TENANT_BEAT_TENANT_CACHE="default")
+    def test_backend_local(self):
+        """Lookups use a local copy of the tenants, briefly, rather than the backend."""
+        with patch.object(cache, "get_or_set", wraps=cache.get_or_set) as get_or_set:
+            for _ in range(10):
+                tenant_cache.get_by_pk(self.tenants[1].pk)
+        self.assertEqual(get_or_set.call_count, 1)
+
+        tenant_cache.clear()
+        with override_settings(TENANT_BEAT_TENANT_CACHE_LOCAL_TIMEOUT=0):
+            with patch.object(cache, "get_or_set", wraps=cache.get_or_set) as get_or_set:
+                tenant_cache.all()
+                tenant_cache.all()
+        self.assertEqual(get_or_set.call_count, 2)
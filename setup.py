@@ -28,8 +28,13 @@ setup(
     keywords="django tenants celery beat multitenancy postgres postgresql",
     packages=[
         "django_tenants_celery_beat",
+        "django_tenants_celery_beat.management",
+        "django_tenants_celery_beat.management.commands",
         "django_tenants_celery_beat.migrations",
     ],
+    package_data={
+        "django_tenants_celery_beat": ["templates/django_tenants_celery_beat/admin/*"],
+    },
     install_requires=[
         "Django>=2.0",
         "django-tenants>=3.0.0",